@@ -4,8 +4,10 @@
 #####################################################################
 __author__ = 'cristianrojas'
 ######               Importacion de librerias                 #######
+import os
 import time
 import threading
+import collections
 import multiprocessing as mp
 
 import smbus
@@ -19,6 +21,8 @@ import backup
 import datetime
 import x708
 import rfiduhf
+from metricas import REGISTRO
+import perfilador
 
 
 
@@ -35,6 +39,15 @@ PERIODOVALIDACION = 1  # Cantidad de dias para exigir validacion
 MAXLIMITVECPESOS = 500 # Cantidad maxima de datos a usar para el vector de pesos
 TIEMPO_CHECK_BATERIA = 30 # segundos
 VOLTAJE_BATERIA_APAGADO = 3.1
+BUFFER_MUESTRAS = 2000  # Muestras maximas en espera entre adquisicion y procesamiento
+FACTOR_HUECO = 3  # Un intervalo mayor a este factor por el intervalo medio se cuenta como hueco
+PRIORIDAD_ADQUISICION = -10  # Nice del hilo de adquisicion
+METRICAS_PUERTO_HTTP = 9108  # Proceso principal (hilos RFID, sincronizacion)
+METRICAS_PUERTO_HTTP_PESO = 9109  # Proceso GetPeso
+METRICAS_ARCHIVO = "/home/pi/datos/logData/metricas.json"
+METRICAS_ARCHIVO_PESO = "/home/pi/datos/logData/metricas_peso.json"
+PERFIL_DIRECTORIO = "/home/pi/datos/logData"
+PERFIL_DISPARO = "/home/pi/datos/perfilar"  # touch (o echo <segundos>) para perfilar ambos procesos
 #####################################################################
 ######               Declaracion de pines                     #######
 R = 17
@@ -47,6 +60,89 @@ SCK = 9
 
 #####################################################################
 ######               Hilos de ejecucion                       #######
+#### Hilo de adquisicion de la celda de carga (corre dentro del proceso GetPeso)
+class AdquisicionPeso(threading.Thread):
+    def __init__(self, meanData, capacidad=BUFFER_MUESTRAS):
+        threading.Thread.__init__(self, daemon=True, name="adquisicion-peso")
+        self.meanData = meanData
+        self.muestras = collections.deque()
+        self.capacidad = capacidad
+        self.condicion = threading.Condition()
+        self.intervaloMedio = None
+        self.tasa = 0.0
+        self.huecos = 0
+        self.desbordes = 0
+        self.mIntervalo = REGISTRO.histograma("peso_intervalo_muestras_segundos", "Intervalo entre muestras adquiridas",
+                                              buckets=(0.01, 0.02, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0, 2.0))
+        self.mJitter = REGISTRO.gauge("peso_jitter_muestras_segundos", "Desviacion media (EWMA) del intervalo")
+        self.mTasa = REGISTRO.gauge("peso_tasa_muestras_hz", "Muestras por segundo logradas")
+        self.mHuecos = REGISTRO.contador("peso_huecos_total", "Intervalos mayores a FACTOR_HUECO veces el medio")
+        self.mDesbordes = REGISTRO.contador("peso_desbordes_total", "Muestras descartadas por buffer lleno")
+        self.mErrores = REGISTRO.contador("peso_errores_adquisicion_total", "Errores leyendo el HX711")
+        REGISTRO.gauge("peso_buffer_muestras", "Muestras en espera de procesar", funcion=lambda: len(self.muestras))
+
+    def Subir_prioridad(self):
+        # Nice por hilo (Linux); requiere permisos, si no se puede se sigue con la prioridad normal
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PRIORIDAD_ADQUISICION)
+        except (OSError, AttributeError) as e:
+            print("No se pudo subir la prioridad de adquisicion: ", repr(e))
+
+    def run(self):
+        self.Subir_prioridad()
+        jitter = 0.0
+        tAnterior = time.perf_counter()
+        tVentana = tAnterior
+        nVentana = 0
+        while True:
+            try:
+                dato = sensor.Get_lectura(self.meanData)
+            except Exception as E:
+                self.mErrores.inc()
+                print("ERROR DE ADQUISICION DE PESO: ", repr(E))
+                time.sleep(0.01)
+                continue
+            ahora = time.perf_counter()
+            ts = time.time()
+            intervalo = ahora - tAnterior
+            tAnterior = ahora
+
+            self.mIntervalo.observar(intervalo)
+            if self.intervaloMedio is None:
+                self.intervaloMedio = intervalo
+            else:
+                if intervalo > FACTOR_HUECO * self.intervaloMedio:
+                    self.huecos += 1
+                    self.mHuecos.inc()
+                self.intervaloMedio += 0.05 * (intervalo - self.intervaloMedio)
+                jitter += 0.05 * (abs(intervalo - self.intervaloMedio) - jitter)
+                self.mJitter.set(jitter)
+
+            nVentana += 1
+            if ahora - tVentana >= 1.0:
+                self.tasa = nVentana / (ahora - tVentana)
+                self.mTasa.set(self.tasa)
+                tVentana = ahora
+                nVentana = 0
+
+            with self.condicion:
+                if len(self.muestras) >= self.capacidad:
+                    self.muestras.popleft()
+                    self.desbordes += 1
+                    self.mDesbordes.inc()
+                self.muestras.append((ts, dato))
+                self.condicion.notify()
+
+    def Obtener_lote(self):
+        """Bloquea hasta que haya muestras y devuelve todas las pendientes en orden."""
+        with self.condicion:
+            while not self.muestras:
+                self.condicion.wait()
+            lote = list(self.muestras)
+            self.muestras.clear()
+        return lote
+
+
 #### Hilo encargado de leer los valores de peso
 class GetPeso(mp.Process):
     def __init__(self):
@@ -82,6 +178,8 @@ class GetPeso(mp.Process):
         self.RFID_ON = 0
         self.vastago = float(funciones.Get_parametro("Vastago"))
         self.pesovastago = 0.0
+        self.tInicioRacimo = None
+        self.adquisicion = None
 
     def Llenar_vector(self):
         for i in range(0, self.RETRASOS):
@@ -93,8 +191,10 @@ class GetPeso(mp.Process):
             self.vectorFiltro.append(lectura)
 
     def Get_lectura(self):
+        self.Procesar_lectura(sensor.Get_lectura(self.MEAN_DATA))
+
+    def Procesar_lectura(self, dato):
         self.lecturaAnterior = self.lectura
-        dato = sensor.Get_lectura(self.MEAN_DATA)
         self.vectorFiltro = funciones.Shift(self.vectorFiltro, dato)
         funciones.Log_datos(self.vectorFiltro[len(self.vectorFiltro)-1], "/home/pi/datos/logData/SinFiltro.txt")
         self.vectorFiltro = funciones.Filtro_picos(self.vectorFiltro, pd=0.8)
@@ -164,7 +264,12 @@ class GetPeso(mp.Process):
             self.viaje_id = funciones.Get_last_viaje()
             if self.estado == 0:
                 self.pesovastago = round((float(peso) * float(self.vastago)), 2)
-                funciones.Update_db(peso, self.estado, fecha, self.viaje_id, self.cantidad, self.RFIDserial,self.pesovastago)
+                with REGISTRO.histograma("peso_db_segundos", "Latencia de llamadas a la BD", op="update_db").tiempo():
+                    funciones.Update_db(peso, self.estado, fecha, self.viaje_id, self.cantidad, self.RFIDserial,self.pesovastago)
+                if self.tInicioRacimo is not None:
+                    REGISTRO.histograma("peso_racimo_a_commit_segundos", "Desde el primer dato del racimo hasta el commit",
+                                        buckets=(0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60)).observar(time.time() - self.tInicioRacimo)
+                REGISTRO.contador("peso_racimos_total", "Racimos guardados").inc()
 
         else:
             print("Cantidad de datos insuficientes para obtener un peso valido")
@@ -192,51 +297,78 @@ class GetPeso(mp.Process):
         except Exception as e:
             print("ERROR VALIDANDO CERO: ", repr(e))
 
-    def run(self):
-        self.Llenar_vector()
-        czero = 0
-        badzero = 0
-        while True:
-            try:
-                self.Get_lectura()
-                if self.zeroInit == 0:
-                    czero+=1
-                    if (-2.0 < self.lectura < 2.0):
-                        self.zeroInicial = funciones.Shift(self.zeroInicial, abs(self.lectura))
-                        if czero >= 550:
-                            self.zeroIniprom = abs(np.mean(self.zeroInicial[24:474]))
-                            if self.zeroIniprom > 0.05:
-                                print("Error en el cero")
-                            print("Cero Inicial: ",self.zeroIniprom)
-                            self.zeroInit = 1
-                            self.tin = time.time()
-                    else:
-                        badzero+=1
-                        if badzero >= 150:
-                            print("Cero inestable")
-                            self.zeroIniprom = abs(np.mean(self.zeroInicial))
-                            self.zeroInit = 1
-                            self.tin = time.time()
-                    self.vectorZero = self.zeroInicial
-
-                if (self.lectura < 0.3) and self.zeroInit == 1:
-                    self.vectorZero = funciones.Shift(self.vectorZero, abs(self.lectura))
-
-                self.tend = time.time()
-                if (self.tend - self.tin) > 15:
-                    self.Validar_cero(self.vectorZero)
+    def Procesar_muestra(self, ts, dato):
+        """Filtro, seguimiento de cero y maquina de estados para una muestra ya adquirida."""
+        self.Procesar_lectura(dato)
+        if self.zeroInit == 0:
+            self.czero+=1
+            if (-2.0 < self.lectura < 2.0):
+                self.zeroInicial = funciones.Shift(self.zeroInicial, abs(self.lectura))
+                if self.czero >= 550:
+                    self.zeroIniprom = abs(np.mean(self.zeroInicial[24:474]))
+                    if self.zeroIniprom > 0.05:
+                        print("Error en el cero")
+                    print("Cero Inicial: ",self.zeroIniprom)
+                    self.zeroInit = 1
                     self.tin = time.time()
+            else:
+                self.badzero+=1
+                if self.badzero >= 150:
+                    print("Cero inestable")
+                    self.zeroIniprom = abs(np.mean(self.zeroInicial))
+                    self.zeroInit = 1
+                    self.tin = time.time()
+            self.vectorZero = self.zeroInicial
 
-                self.Actualizar_estado()
+        if (self.lectura < 0.3) and self.zeroInit == 1:
+            self.vectorZero = funciones.Shift(self.vectorZero, abs(self.lectura))
 
-                if self.estadoActual:
-                    self.Guardar_datos()
-                elif not self.estadoActual and self.estadoAnterior:
-                    self.Update_db()
-                    self.RFIDserial = ''
-                    self.VectorZero = self.zeroInicial
-            except Exception as E:
-                print("ERROR DE LECTURA DE PESO: ", repr(E))
+        self.tend = time.time()
+        if (self.tend - self.tin) > 15:
+            self.Validar_cero(self.vectorZero)
+            self.tin = time.time()
+
+        self.Actualizar_estado()
+
+        if self.estadoActual:
+            if not self.estadoAnterior:
+                self.tInicioRacimo = ts
+            self.Guardar_datos()
+        elif not self.estadoActual and self.estadoAnterior:
+            self.Update_db()
+            self.RFIDserial = ''
+            self.VectorZero = self.zeroInicial
+            self.tInicioRacimo = None
+
+    def run(self):
+        # Metricas del proceso hijo: registro propio con exportacion independiente
+        REGISTRO.iniciar_http(METRICAS_PUERTO_HTTP_PESO)
+        REGISTRO.iniciar_instantaneas(METRICAS_ARCHIVO_PESO)
+        perfilador.instalar("GetPeso", PERFIL_DIRECTORIO, PERFIL_DISPARO)
+        mProcesamiento = REGISTRO.histograma("peso_procesamiento_muestra_segundos", "Procesamiento de una muestra")
+        mLote = REGISTRO.histograma("peso_lote_muestras", "Muestras por lote procesado",
+                                    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 256))
+        mLectura = REGISTRO.gauge("peso_lectura_kg", "Ultima lectura filtrada")
+        mErrores = REGISTRO.contador("peso_errores_total", "Errores en el loop de lectura")
+
+        self.Llenar_vector()
+        self.czero = 0
+        self.badzero = 0
+        # La adquisicion corre en su propio hilo: un paso lento aqui no retrasa la siguiente muestra
+        self.adquisicion = AdquisicionPeso(self.MEAN_DATA)
+        self.adquisicion.start()
+        while True:
+            lote = self.adquisicion.Obtener_lote()
+            mLote.observar(len(lote))
+            for ts, dato in lote:
+                t0 = time.perf_counter()
+                try:
+                    self.Procesar_muestra(ts, dato)
+                    mLectura.set(self.lectura)
+                except Exception as E:
+                    mErrores.inc()
+                    print("ERROR DE LECTURA DE PESO: ", repr(E))
+                mProcesamiento.observar(time.perf_counter() - t0)
 
 
 ### Hilo de subida de datos a la web
@@ -330,129 +462,136 @@ class RFIDRead(threading.Thread):
 ######               Metodos de inicializacion                #######
 
 
-### Inicializacion de base de datos
-funciones.Conect_db_parametros()
-
-### Inicializacion de parametros
-funciones.Set_parametro("cant_rapido", CANTDATOSRACIMO)
-funciones.Set_parametro("lb", 0)
-funciones.Set_parametro("RFID_ON",0)
-funciones.Set_parametro("nuevo_viaje", 0)
-
-### Validacion de la conexion a internet
-while (online == 0) & (intentosConexion < 5):
-    try:
-        online = funciones.Test_online()
-        if online == 0:
-            intentosConexion += 1
-        print(intentosConexion)
-    except:
-        intentosConexion = intentosConexion + 1
-        print(intentosConexion)
-
-# Guardar el estado del contenido de las tablas
-contentTablas = funciones.Check_contenido_tablas(SYNCTABLAS)
-
-### Actualizacion de tablas
-if online or not contentTablas:
-    ### Aviso de inicio al servidor ##### QUITAR
-    estomaInfo = credentials.Get_Estoma_Info()
-    estomaId = estomaInfo[0]
-    print(funciones.Web_conex("inicio", estomaId, timeout=5))
-    # Vectores para el manejo de los estados de descarga de las tablas
-    estadoTablas = []
-    estados = []
-    # Concatenar el estado cero al vector de tablas
-    for tabla in SYNCTABLAS:
-        estadoTablas.append([tabla, 0])
-    # ejecutar el ciclo mientras alguno de los estados de las tablas siga siendo cero
-    [estados.append(estado[1]) for estado in estadoTablas]
-    while min(estados) < 1:
+# El arranque solo corre como script: importar el modulo (p.ej. banco_peso.py) no toca hardware ni BD
+if __name__ == "__main__":
+    ### Inicializacion de base de datos
+    funciones.Conect_db_parametros()
+
+    ### Inicializacion de parametros
+    funciones.Set_parametro("cant_rapido", CANTDATOSRACIMO)
+    funciones.Set_parametro("lb", 0)
+    funciones.Set_parametro("RFID_ON",0)
+    funciones.Set_parametro("nuevo_viaje", 0)
+
+    ### Validacion de la conexion a internet
+    while (online == 0) & (intentosConexion < 5):
         try:
-            for tabla in estadoTablas:
-                nombre = tabla[0]
-                estado = tabla[1]
-                if estado == 0:
-                    funciones.Actualizar_tabla(nombre)
-                if funciones.Check_contenido_tablas([tabla[0]]):
-                    tabla[1] = 1
+            online = funciones.Test_online()
+            if online == 0:
+                intentosConexion += 1
+            print(intentosConexion)
+        except:
+            intentosConexion = intentosConexion + 1
+            print(intentosConexion)
+
+    # Guardar el estado del contenido de las tablas
+    contentTablas = funciones.Check_contenido_tablas(SYNCTABLAS)
+
+    ### Actualizacion de tablas
+    if online or not contentTablas:
+        ### Aviso de inicio al servidor ##### QUITAR
+        estomaInfo = credentials.Get_Estoma_Info()
+        estomaId = estomaInfo[0]
+        print(funciones.Web_conex("inicio", estomaId, timeout=5))
+        # Vectores para el manejo de los estados de descarga de las tablas
+        estadoTablas = []
+        estados = []
+        # Concatenar el estado cero al vector de tablas
+        for tabla in SYNCTABLAS:
+            estadoTablas.append([tabla, 0])
+        # ejecutar el ciclo mientras alguno de los estados de las tablas siga siendo cero
+        [estados.append(estado[1]) for estado in estadoTablas]
+        while min(estados) < 1:
+            try:
+                for tabla in estadoTablas:
+                    nombre = tabla[0]
+                    estado = tabla[1]
+                    if estado == 0:
+                        funciones.Actualizar_tabla(nombre)
+                    if funciones.Check_contenido_tablas([tabla[0]]):
+                        tabla[1] = 1
 
-            print(estadoTablas)
+                print(estadoTablas)
 
-            estados = []
-            [estados.append(estado[1]) for estado in estadoTablas]
+                estados = []
+                [estados.append(estado[1]) for estado in estadoTablas]
 
-        except Exception as e:
-            print("ERROR ACTUALIZANDO TABLAS: ", repr(e))
-
-cod_barcadillero = funciones.Get_barcadillero()
-funciones.Set_parametro("barcadillero_codigo", cod_barcadillero)
-
-vastago = funciones.Get_vastago()
-funciones.Set_parametro("Vastago", vastago)
-
-PESOMINIMO = float(funciones.Get_parametro_estoma("peso_minimo_racimitos"))
-print("Peso minimo: ", PESOMINIMO)
-PESOMAXIMO = float(funciones.Get_parametro_estoma("peso_maximo_racimitos"))
-print("Peso maximo: ", PESOMAXIMO)
-TARA = float(funciones.Get_parametro_estoma("tara_racimitos"))
-print("Tara: ", TARA)
-TARAPRIMERO = float(funciones.Get_parametro_estoma("tara_primer_racimito"))
-print("Tara primer racimo: ", TARAPRIMERO)
-TIEMPOMINIMO = float(funciones.Get_parametro_estoma("tiempo_minimo_racimitos"))
-print("Tiempo minimo entre racimos: ", TIEMPOMINIMO)
-funciones.Save_wifi()
-
-
-### Crear parametro de lote_default
-cursor, conectar = funciones.Create_cursor(json=True)
-conectar.commit()
-cursor.execute("select * from lotes limit 1")
-recs = cursor.fetchall()
-rows = [dict(rec) for rec in recs]
-funciones.Set_parametro("lote_default", rows[0]['lote_id'])
-
-
-#### Validacion de validacion diaria
-lastValidacion = funciones.Get_Last_Validacion()
-fechaHoy = funciones.Actualizar_hora(dia=1)
-print("Ultima Validacion: ", lastValidacion, "Fecha actual: ", fechaHoy)
-if lastValidacion is not None:
-    print("Diferencia: ", (fechaHoy - lastValidacion.date()).days)
-
-
-if lastValidacion is None or (fechaHoy - lastValidacion.date()).days >= PERIODOVALIDACION:
-    calibracion = 2
-    validacion = 0
-else:
-    print("Validacion de equipo se encuntra al dia")
-    validacion = 0
-
-
-#Revision cero
-funciones.Get_info_cero()
-
-### Inicializacion de sensor de peso
-sensor = hs.HxSigma(debug=HXDEBUG)
-funciones.Set_parametro("validacion", validacion)
-
-funciones.Set_parametro('estado_hx', 6)
-print("INICIANDO")
-
-### Inicializacion de hilos
-lecturaPeso = GetPeso()
-sincronizacion = UpLoad()
-bateria = CheckBat()
-# RFID = RFIDRead()  # replaced by RFIDUHF
-
-lecturaPeso.start()
-sincronizacion.start()
-bateria.start()
-# RFID.start()  # replaced
-rfid = rfiduhf.RFIDUHF()
-thread_rfid = threading.Thread(target=rfid.run)
-thread_rfid.start()
-
-
-funciones.Set_parametro('estado_hx', -666)
-print("BASCULA LISTA PARA PESAR")
\ No newline at end of file
+            except Exception as e:
+                print("ERROR ACTUALIZANDO TABLAS: ", repr(e))
+
+    cod_barcadillero = funciones.Get_barcadillero()
+    funciones.Set_parametro("barcadillero_codigo", cod_barcadillero)
+
+    vastago = funciones.Get_vastago()
+    funciones.Set_parametro("Vastago", vastago)
+
+    PESOMINIMO = float(funciones.Get_parametro_estoma("peso_minimo_racimitos"))
+    print("Peso minimo: ", PESOMINIMO)
+    PESOMAXIMO = float(funciones.Get_parametro_estoma("peso_maximo_racimitos"))
+    print("Peso maximo: ", PESOMAXIMO)
+    TARA = float(funciones.Get_parametro_estoma("tara_racimitos"))
+    print("Tara: ", TARA)
+    TARAPRIMERO = float(funciones.Get_parametro_estoma("tara_primer_racimito"))
+    print("Tara primer racimo: ", TARAPRIMERO)
+    TIEMPOMINIMO = float(funciones.Get_parametro_estoma("tiempo_minimo_racimitos"))
+    print("Tiempo minimo entre racimos: ", TIEMPOMINIMO)
+    funciones.Save_wifi()
+
+
+    ### Crear parametro de lote_default
+    cursor, conectar = funciones.Create_cursor(json=True)
+    conectar.commit()
+    cursor.execute("select * from lotes limit 1")
+    recs = cursor.fetchall()
+    rows = [dict(rec) for rec in recs]
+    funciones.Set_parametro("lote_default", rows[0]['lote_id'])
+
+
+    #### Validacion de validacion diaria
+    lastValidacion = funciones.Get_Last_Validacion()
+    fechaHoy = funciones.Actualizar_hora(dia=1)
+    print("Ultima Validacion: ", lastValidacion, "Fecha actual: ", fechaHoy)
+    if lastValidacion is not None:
+        print("Diferencia: ", (fechaHoy - lastValidacion.date()).days)
+
+
+    if lastValidacion is None or (fechaHoy - lastValidacion.date()).days >= PERIODOVALIDACION:
+        calibracion = 2
+        validacion = 0
+    else:
+        print("Validacion de equipo se encuntra al dia")
+        validacion = 0
+
+
+    #Revision cero
+    funciones.Get_info_cero()
+
+    ### Inicializacion de sensor de peso
+    sensor = hs.HxSigma(debug=HXDEBUG)
+    funciones.Set_parametro("validacion", validacion)
+
+    funciones.Set_parametro('estado_hx', 6)
+    print("INICIANDO")
+
+    ### Inicializacion de hilos
+    lecturaPeso = GetPeso()
+    sincronizacion = UpLoad()
+    bateria = CheckBat()
+    # RFID = RFIDRead()  # replaced by RFIDUHF
+
+    lecturaPeso.start()
+    sincronizacion.start()
+    bateria.start()
+    # RFID.start()  # replaced
+    rfid = rfiduhf.RFIDUHF()
+    thread_rfid = threading.Thread(target=rfid.run)
+    thread_rfid.start()
+
+    # Se inicia despues de lecturaPeso.start() para no heredar hilos en el fork
+    REGISTRO.iniciar_http(METRICAS_PUERTO_HTTP)
+    REGISTRO.iniciar_instantaneas(METRICAS_ARCHIVO)
+    perfilador.instalar("principal", PERFIL_DIRECTORIO, PERFIL_DISPARO)
+
+
+    funciones.Set_parametro('estado_hx', -666)
+    print("BASCULA LISTA PARA PESAR")
\ No newline at end of file
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Buffer circular de tamano fijo en memoria compartida (un productor, un consumidor).
+
+Lo usan los procesos lectores (modo proceso-por-lector) para entregar las
+notificaciones de tags decodificadas al agregador del proceso principal sin
+pasar por pickling ni por el GIL del agregador.
+
+Disposicion: cabecera de 3 uint64 (cabeza, cola, descartados) seguida de
+`capacidad` registros fijos de 24 bytes: ts (double), EPC (12 bytes), RSSI
+(int8). El productor solo escribe `cola` y `descartados`, el consumidor solo
+`cabeza`; los indices crecen sin limite y el slot es indice & (capacidad-1).
+"""
+import struct
+from multiprocessing import shared_memory
+
+REGISTRO = struct.Struct("<d12sb3x")
+CABECERA = struct.Struct("<QQQ")
+_INDICE = struct.Struct("<Q")
+_OFF_CABEZA = 0
+_OFF_COLA = 8
+_OFF_DESCARTADOS = 16
+
+
+class AnilloCompartido:
+    def __init__(self, capacidad=8192, nombre=None):
+        """Crea el segmento si `nombre` es None; si no, se adjunta al existente."""
+        if capacidad & (capacidad - 1):
+            raise ValueError("la capacidad debe ser potencia de 2")
+        self.capacidad = capacidad
+        self._mascara = capacidad - 1
+        tamano = CABECERA.size + capacidad * REGISTRO.size
+        self._propietario = nombre is None
+        if self._propietario:
+            self.shm = shared_memory.SharedMemory(create=True, size=tamano)
+            CABECERA.pack_into(self.shm.buf, 0, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=nombre)
+        self.nombre = self.shm.name
+        self._buf = self.shm.buf
+        # Copias locales de los indices propios para no releerlos de la memoria compartida
+        self._cola = _INDICE.unpack_from(self._buf, _OFF_COLA)[0]
+        self._cabeza = _INDICE.unpack_from(self._buf, _OFF_CABEZA)[0]
+        self._descartados = _INDICE.unpack_from(self._buf, _OFF_DESCARTADOS)[0]
+
+    def __reduce__(self):
+        # Con spawn el proceso hijo se adjunta por nombre; con fork hereda el mapeo
+        return (AnilloCompartido, (self.capacidad, self.nombre))
+
+    # ----------------------------------------
+    # PRODUCTOR
+    # ----------------------------------------
+    def push(self, ts, epc, rssi):
+        cola = self._cola
+        if cola - _INDICE.unpack_from(self._buf, _OFF_CABEZA)[0] >= self.capacidad:
+            self._descartados += 1
+            _INDICE.pack_into(self._buf, _OFF_DESCARTADOS, self._descartados)
+            return False
+        REGISTRO.pack_into(self._buf, CABECERA.size + (cola & self._mascara) * REGISTRO.size, ts, epc, rssi)
+        # La cola se publica despues de escribir el registro
+        self._cola = cola + 1
+        _INDICE.pack_into(self._buf, _OFF_COLA, self._cola)
+        return True
+
+    # ----------------------------------------
+    # CONSUMIDOR
+    # ----------------------------------------
+    def pop_lote(self, maximo=1024):
+        """Devuelve hasta `maximo` registros (ts, epc_bytes, rssi) en orden de llegada."""
+        cabeza = self._cabeza
+        cola = _INDICE.unpack_from(self._buf, _OFF_COLA)[0]
+        n = min(cola - cabeza, maximo)
+        if n <= 0:
+            return []
+        lote = []
+        base = CABECERA.size
+        tam = REGISTRO.size
+        mascara = self._mascara
+        buf = self._buf
+        for i in range(cabeza, cabeza + n):
+            lote.append(REGISTRO.unpack_from(buf, base + (i & mascara) * tam))
+        self._cabeza = cabeza + n
+        _INDICE.pack_into(buf, _OFF_CABEZA, self._cabeza)
+        return lote
+
+    def pendientes(self):
+        return _INDICE.unpack_from(self._buf, _OFF_COLA)[0] - _INDICE.unpack_from(self._buf, _OFF_CABEZA)[0]
+
+    def descartados(self):
+        return _INDICE.unpack_from(self._buf, _OFF_DESCARTADOS)[0]
+
+    def cerrar(self):
+        self._buf = None
+        self.shm.close()
+        if self._propietario:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+Banco de pruebas reproducible para el loop de pesaje (GetPeso).
+
+Reemplaza el HX711 (hxsigma), `funciones` y la BD por simulaciones y
+reproduce trazas de la celda de carga, sinteticas o grabadas, llamando a
+GetPeso.Procesar_muestra muestra por muestra con un reloj simulado. Reporta:
+  - tiempo de procesamiento por muestra (p50/p99/max)
+  - latencia de deteccion (flanco de subida) y de commit (fin real -> Update_db)
+  - racimos/minuto en la traza y maximo sostenible por el loop
+  - error de peso contra la verdad de la traza, racimos perdidos y espurios
+
+Escenarios sinteticos: racimos, picos, deriva, rapidos.
+
+Uso:
+  python banco_peso.py                              # todos los escenarios
+  python banco_peso.py --escenario rapidos --latencia-db 0.005
+  python banco_peso.py --traza SinFiltro.csv --hz 12.5 [--verdad verdad.csv]
+  python banco_peso.py --guardar base.json          # linea base
+  python banco_peso.py --referencia base.json       # falla (codigo 1) si hay regresion
+
+Las simulaciones de Shift/Filtro_picos aproximan las de `funciones`; con
+--funciones-reales se usan las del modulo real si es importable (las llamadas
+a BD siguen simuladas).
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import io
+import json
+import random
+import sys
+import time
+import types
+
+# Modulos de hardware que no existen fuera del equipo
+_MODULOS_EQUIPO = ("smbus", "credentials", "bat", "backup", "x708", "hxsigma", "rfiduhf")
+
+
+class FuncionesSimuladas(types.ModuleType):
+    """Sustituto de `funciones`: parametros en memoria, BD simulada con latencia opcional."""
+
+    def __init__(self, reloj, latencia_db=0.0, latencia_log=0.0, reales=None):
+        types.ModuleType.__init__(self, "funciones")
+        self.reloj = reloj
+        self.latencia_db = latencia_db
+        self.latencia_log = latencia_log
+        self.parametros = {"Vastago": 0.0, "RFID_ON": 0, "RFID_SERIAL": "", "nuevo_viaje": 0}
+        self.commits = []  # (t_sim, peso, estado, viaje_id, cantidad)
+        self.viaje = None
+        self.llamadas_db = 0
+        if reales is not None:
+            self.Shift = reales.Shift
+            self.Filtro_picos = reales.Filtro_picos
+
+    def _db(self):
+        self.llamadas_db += 1
+        if self.latencia_db:
+            time.sleep(self.latencia_db)
+
+    # --- procesamiento de senal ---
+    @staticmethod
+    def Shift(vector, dato):
+        return vector[1:] + [dato]
+
+    @staticmethod
+    def Filtro_picos(vector, pd=0.8):
+        # Un punto que se aleja mas de `pd` de ambos vecinos en la misma direccion se reemplaza por su media
+        v = list(vector)
+        for i in range(1, len(v) - 1):
+            a, b, c = v[i - 1], v[i], v[i + 1]
+            if (b - a > pd and b - c > pd) or (a - b > pd and c - b > pd):
+                v[i] = (a + c) / 2.0
+        return v
+
+    def Log_datos(self, dato, archivo):
+        if self.latencia_log:
+            time.sleep(self.latencia_log)
+
+    # --- parametros y BD ---
+    def Get_parametro(self, nombre):
+        self._db()
+        return self.parametros.get(nombre, 0)
+
+    def Set_parametro(self, nombre, valor):
+        self._db()
+        self.parametros[nombre] = valor
+
+    def Actualizar_hora(self, dia=0):
+        t = datetime.datetime.fromtimestamp(self.reloj.t)
+        return t.date() if dia else t.strftime('%Y-%m-%d %H:%M:%S')
+
+    def Get_last_racimito(self):
+        self._db()
+        if not self.commits:
+            return None
+        return datetime.datetime.fromtimestamp(int(self.commits[-1][0]))
+
+    def Get_last_viaje(self):
+        self._db()
+        return self.viaje
+
+    def Set_fecha_final(self):
+        self._db()
+
+    def Crear_viaje(self):
+        self._db()
+        self.viaje = (self.viaje or 0) + 1
+
+    def Update_db(self, peso, estado, fecha, viaje_id, cantidad, serial, pesovastago):
+        self._db()
+        self.commits.append((self.reloj.t, peso, estado, viaje_id, cantidad))
+
+
+class RelojSimulado:
+    def __init__(self, t0):
+        self.t = t0
+
+
+class TimeSimulado(types.ModuleType):
+    """Sustituto del modulo `time` dentro de Pesaje_Racimos: time() sigue al reloj simulado.
+
+    Asi la validacion de cero (cada 15 s) y las latencias de Update_db avanzan
+    con la traza y no con el tiempo real de la reproduccion.
+    """
+
+    def __init__(self, reloj):
+        types.ModuleType.__init__(self, "time")
+        self._reloj = reloj
+
+    def time(self):
+        return self._reloj.t
+
+    def __getattr__(self, nombre):
+        return getattr(time, nombre)
+
+
+class SensorSimulado:
+    """Sustituto de hxsigma.HxSigma: entrega la traza muestra a muestra (Llenar_vector)."""
+
+    def __init__(self, valores):
+        self._valores = iter(valores)
+
+    def Get_lectura(self, mean_data):
+        return next(self._valores)
+
+
+# ----------------------------------------
+# TRAZAS
+# ----------------------------------------
+def _racimo(rng, hz, peso, plateau, subida=0.3):
+    """Muestras de un racimo: subida, balanceo amortiguado y bajada."""
+    muestras = []
+    n_sub = max(1, int(subida * hz))
+    for i in range(n_sub):
+        muestras.append(peso * (i + 1) / n_sub)
+    amplitud = 0.08 * peso
+    for i in range(int(plateau * hz)):
+        t = i / hz
+        muestras.append(peso + amplitud * (0.5 ** (t / 0.8)) * ((i % 6) - 2.5) / 2.5 + rng.gauss(0, 0.05))
+    for i in range(n_sub):
+        muestras.append(peso * (n_sub - i - 1) / n_sub)
+    return muestras
+
+
+def generar_traza(escenario, hz=12.5, n_racimos=30, semilla=1):
+    """Devuelve (valores, verdad) con verdad = [(t_inicio, t_fin, peso)] en segundos desde 0."""
+    rng = random.Random(semilla)
+    valores = [rng.gauss(0, 0.02) for _ in range(int(45 * hz))]  # cero inicial para Validar_cero
+    verdad = []
+    pausa = (1.0, 2.0) if escenario == "rapidos" else (4.0, 10.0)
+    for _ in range(n_racimos):
+        peso = rng.uniform(15, 45)
+        inicio = len(valores) / hz
+        valores += _racimo(rng, hz, peso, rng.uniform(2.0, 5.0))
+        verdad.append((inicio, len(valores) / hz, peso))
+        valores += [rng.gauss(0, 0.02) for _ in range(int(rng.uniform(*pausa) * hz))]
+    valores += [rng.gauss(0, 0.02) for _ in range(int(5 * hz))]
+
+    if escenario == "picos":
+        for _ in range(len(valores) // 50):
+            i = rng.randrange(len(valores))
+            valores[i] += rng.choice((-1, 1)) * rng.uniform(5, 25)
+    elif escenario == "deriva":
+        n = len(valores)
+        valores = [v + 0.6 * i / n for i, v in enumerate(valores)]
+    return valores, verdad
+
+
+def cargar_traza(archivo, hz):
+    """CSV con `valor` por linea o `t,valor`; sin t se asume frecuencia `hz`."""
+    valores, tiempos = [], []
+    with open(archivo) as f:
+        for fila in csv.reader(f):
+            try:
+                numeros = [float(x) for x in fila if x.strip()]
+            except ValueError:
+                continue
+            if len(numeros) == 1:
+                valores.append(numeros[0])
+            elif len(numeros) >= 2:
+                tiempos.append(numeros[0])
+                valores.append(numeros[1])
+    if tiempos and len(tiempos) == len(valores):
+        t0 = tiempos[0]
+        return valores, [t - t0 for t in tiempos]
+    return valores, None
+
+
+def cargar_verdad(archivo):
+    with open(archivo) as f:
+        return [(float(r[0]), float(r[1]), float(r[2])) for r in csv.reader(f) if r and r[0][0].isdigit()]
+
+
+# ----------------------------------------
+# EJECUCION
+# ----------------------------------------
+def importar_pesaje(funciones_sim):
+    for nombre in _MODULOS_EQUIPO:
+        sys.modules.setdefault(nombre, types.ModuleType(nombre))
+    try:
+        import serial  # noqa: F401  (solo lo usa RFIDRead, que el banco no ejecuta)
+    except ImportError:
+        sys.modules["serial"] = types.ModuleType("serial")
+    sys.modules["funciones"] = funciones_sim
+    import Pesaje_Racimos
+    Pesaje_Racimos.funciones = funciones_sim
+    return Pesaje_Racimos
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100.0))]
+
+
+def ejecutar(valores, verdad, hz, tiempos=None, latencia_db=0.0, latencia_log=0.0, reales=None):
+    t0 = 1700000000.0
+    reloj = RelojSimulado(t0)
+    fs = FuncionesSimuladas(reloj, latencia_db, latencia_log, reales)
+    pr = importar_pesaje(fs)
+    # Parametros que en el equipo vienen de la BD
+    pr.TARA = 0.0
+    pr.TARAPRIMERO = 0.0
+    pr.PESOMINIMO = 1.0
+    pr.PESOMAXIMO = 80.0
+    pr.TIEMPOMINIMO = 600.0
+
+    peso = pr.GetPeso()
+    pr.sensor = SensorSimulado(valores[:peso.RETRASOS])
+    validaciones = [0]
+    validar_cero = peso.Validar_cero
+
+    def contar_validacion(zero):
+        validaciones[0] += 1
+        validar_cero(zero)
+    peso.Validar_cero = contar_validacion
+
+    salida = io.StringIO()
+    tiempos_proc = []
+    subidas = []
+    time_real = pr.time
+    pr.time = TimeSimulado(reloj)
+    try:
+        with contextlib.redirect_stdout(salida):
+            peso.Llenar_vector()
+            peso.czero = 0
+            peso.badzero = 0
+            for i, dato in enumerate(valores[peso.RETRASOS:], start=peso.RETRASOS):
+                reloj.t = t0 + (tiempos[i] if tiempos else i / hz)
+                anterior = peso.estadoActual
+                inicio = time.perf_counter()
+                peso.Procesar_muestra(reloj.t, dato)
+                tiempos_proc.append(time.perf_counter() - inicio)
+                if peso.estadoActual and not anterior:
+                    subidas.append(reloj.t - t0)
+    finally:
+        pr.time = time_real
+    duracion = (tiempos[-1] if tiempos else len(valores) / hz)
+    total_proc = sum(tiempos_proc)
+
+    resultado = {
+        "muestras": len(tiempos_proc),
+        "proc_p50_us": _percentil(tiempos_proc, 50) * 1e6,
+        "proc_p99_us": _percentil(tiempos_proc, 99) * 1e6,
+        "proc_max_us": max(tiempos_proc) * 1e6 if tiempos_proc else 0.0,
+        "racimos_guardados": len(fs.commits),
+        "racimos_min_traza": len(fs.commits) / duracion * 60 if duracion else 0.0,
+        "racimos_min_sostenible": len(fs.commits) / total_proc * 60 if total_proc else 0.0,
+        "llamadas_db_por_muestra": fs.llamadas_db / max(1, len(tiempos_proc)),
+        "validaciones_cero": validaciones[0],
+        "error_cero": int(peso.ErrorCero),
+        "tiempo_error_cero_s": peso.t_errortotal,
+    }
+    if verdad:
+        resultado.update(_comparar(verdad, [(t - t0, p) for t, p, _, _, _ in fs.commits], subidas))
+    return resultado
+
+
+def _comparar(verdad, commits, subidas, margen=5.0):
+    """Empareja cada racimo real con el primer commit en [fin, fin + margen] y la subida mas cercana al inicio."""
+    errores, lat_commit, lat_subida = [], [], []
+    usados = set()
+    perdidos = 0
+    for inicio, fin, peso in verdad:
+        candidato = None
+        for j, (t, p) in enumerate(commits):
+            if j not in usados and inicio <= t <= fin + margen:
+                candidato = j
+                break
+        if candidato is None:
+            perdidos += 1
+            continue
+        usados.add(candidato)
+        t, p = commits[candidato]
+        errores.append(p - peso)
+        lat_commit.append(t - fin)
+        cercanas = [s - inicio for s in subidas if inicio - 1.0 <= s <= fin]
+        if cercanas:
+            lat_subida.append(min(cercanas))
+    abs_err = [abs(e) for e in errores]
+    return {
+        "racimos_reales": len(verdad),
+        "racimos_perdidos": perdidos,
+        "racimos_espurios": len(commits) - len(usados),
+        "error_medio_kg": sum(errores) / len(errores) if errores else 0.0,
+        "error_abs_medio_kg": sum(abs_err) / len(abs_err) if abs_err else 0.0,
+        "error_abs_max_kg": max(abs_err) if abs_err else 0.0,
+        "latencia_subida_p50_s": _percentil(lat_subida, 50),
+        "latencia_commit_p50_s": _percentil(lat_commit, 50),
+        "latencia_commit_p99_s": _percentil(lat_commit, 99),
+    }
+
+
+# Metricas donde un valor mayor es peor, con tolerancia absoluta minima para ruido
+_REGRESIONES = {
+    "proc_p50_us": 5.0,
+    "proc_p99_us": 20.0,
+    "racimos_perdidos": 0,
+    "racimos_espurios": 0,
+    "error_abs_medio_kg": 0.05,
+    "latencia_commit_p99_s": 0.2,
+}
+
+
+def comparar_referencia(resultados, referencia, tolerancia):
+    fallas = []
+    for escenario, r in resultados.items():
+        ref = referencia.get(escenario)
+        if ref is None:
+            continue
+        for clave, minimo in _REGRESIONES.items():
+            if clave not in r or clave not in ref:
+                continue
+            limite = ref[clave] * (1 + tolerancia) + minimo
+            if r[clave] > limite:
+                fallas.append("%s.%s: %.3f > %.3f (ref %.3f)" % (escenario, clave, r[clave], limite, ref[clave]))
+    return fallas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banco de pruebas del loop de pesaje")
+    parser.add_argument("--escenario", choices=("racimos", "picos", "deriva", "rapidos"), action="append")
+    parser.add_argument("--traza", help="CSV grabado (valor o t,valor)")
+    parser.add_argument("--verdad", help="CSV inicio,fin,peso para la traza grabada")
+    parser.add_argument("--hz", type=float, default=12.5)
+    parser.add_argument("--racimos", type=int, default=30)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--latencia-db", type=float, default=0.0, help="segundos por llamada a BD simulada")
+    parser.add_argument("--latencia-log", type=float, default=0.0, help="segundos por Log_datos")
+    parser.add_argument("--funciones-reales", action="store_true")
+    parser.add_argument("--guardar")
+    parser.add_argument("--referencia")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    reales = None
+    if args.funciones_reales:
+        import funciones as reales
+
+    resultados = {}
+    if args.traza:
+        valores, tiempos = cargar_traza(args.traza, args.hz)
+        verdad = cargar_verdad(args.verdad) if args.verdad else None
+        resultados["traza"] = ejecutar(valores, verdad, args.hz, tiempos, args.latencia_db, args.latencia_log, reales)
+    else:
+        for escenario in args.escenario or ("racimos", "picos", "deriva", "rapidos"):
+            valores, verdad = generar_traza(escenario, args.hz, args.racimos, args.semilla)
+            resultados[escenario] = ejecutar(valores, verdad, args.hz, None, args.latencia_db,
+                                             args.latencia_log, reales)
+
+    for escenario, r in resultados.items():
+        print("== %s ==" % escenario)
+        for clave, valor in r.items():
+            print("  %-26s %s" % (clave, "%.3f" % valor if isinstance(valor, float) else valor))
+
+    if args.guardar:
+        with open(args.guardar, "w") as f:
+            json.dump(resultados, f, indent=2)
+    if args.referencia:
+        with open(args.referencia) as f:
+            fallas = comparar_referencia(resultados, json.load(f), args.tolerancia)
+        if fallas:
+            print("REGRESION:")
+            for falla in fallas:
+                print("  " + falla)
+            return 1
+        print("Sin regresiones frente a " + args.referencia)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
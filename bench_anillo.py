@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de escalado: hilos por lector vs proceso por lector con anillo compartido.
+
+Cada "lector" simulado decodifica bloques de bytes con tramas de notificacion
+validas (proceso_lector.extraer_tramas) y entrega los tags a un agregador unico
+equivalente a RegistradorSigma._registrar_tag. Se mide cuantas notificaciones
+por segundo llegan al agregador con 1 a 8 puertos.
+
+Uso: python bench_anillo.py [segundos_por_punto] [max_puertos]
+"""
+import multiprocessing as mp
+import os
+import random
+import sys
+import threading
+import time
+
+from anillo import AnilloCompartido
+from proceso_lector import extraer_tramas
+
+TRAMAS_POR_BLOQUE = 64
+
+
+def _bloque(semilla):
+    random.seed(semilla)
+    datos = bytearray()
+    for _ in range(TRAMAS_POR_BLOQUE):
+        cuerpo = bytes([0x02, 0x22, 0x00, 0x11, random.randint(0xB0, 0xE0), 0x30, 0x00]) + \
+            bytes(random.getrandbits(8) for _ in range(12)) + b"\x00\x00"
+        datos += b"\xBB" + cuerpo + bytes([sum(cuerpo) & 0xFF]) + b"\x7E"
+    return bytes(datos)
+
+
+class _Agregador:
+    def __init__(self):
+        self.escena = {}
+        self.candado = threading.Lock()
+        self.total = 0
+
+    def registrar(self, tag_id, ts):
+        with self.candado:
+            self.total += 1
+            c = self.escena.get(tag_id)
+            self.escena[tag_id] = 1 if c is None else c + 1
+
+
+def _lector_hilo(bloque, agregador, parar):
+    buffer = bytearray()
+    while not parar.is_set():
+        buffer.extend(bloque)
+        notificaciones, _, _ = extraer_tramas(buffer)
+        ahora = time.time()
+        for epc, _rssi in notificaciones:
+            agregador.registrar(int.from_bytes(epc, "big"), ahora)
+
+
+def _lector_proceso(bloque, anillo, parar):
+    buffer = bytearray()
+    while not parar.is_set():
+        buffer.extend(bloque)
+        notificaciones, _, _ = extraer_tramas(buffer)
+        ahora = time.time()
+        for epc, rssi in notificaciones:
+            while not anillo.push(ahora, epc, rssi):
+                if parar.is_set():
+                    return
+                time.sleep(0.0005)
+
+
+def medir_hilos(n, segundos):
+    agregador = _Agregador()
+    parar = threading.Event()
+    hilos = [threading.Thread(target=_lector_hilo, args=(_bloque(i), agregador, parar)) for i in range(n)]
+    for h in hilos:
+        h.start()
+    time.sleep(segundos)
+    parar.set()
+    for h in hilos:
+        h.join()
+    return agregador.total / segundos
+
+
+def medir_procesos(n, segundos):
+    ctx = mp.get_context("fork")
+    agregador = _Agregador()
+    parar = ctx.Event()
+    anillos = [AnilloCompartido(16384) for _ in range(n)]
+    procs = [ctx.Process(target=_lector_proceso, args=(_bloque(i), anillos[i], parar)) for i in range(n)]
+    for p in procs:
+        p.start()
+    fin = time.time() + segundos
+    while time.time() < fin:
+        vacio = True
+        for anillo in anillos:
+            lote = anillo.pop_lote()
+            if lote:
+                vacio = False
+                for ts, epc, _rssi in lote:
+                    agregador.registrar(int.from_bytes(epc, "big"), ts)
+        if vacio:
+            time.sleep(0.0005)
+    parar.set()
+    for p in procs:
+        p.join()
+    for anillo in anillos:
+        anillo.cerrar()
+    return agregador.total / segundos
+
+
+def main():
+    segundos = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    max_puertos = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    print("CPUs: %d, %.1f s por punto" % (os.cpu_count(), segundos))
+    print("%7s %16s %16s %8s" % ("puertos", "hilos (tags/s)", "procesos (tags/s)", "x"))
+    for n in range(1, max_puertos + 1):
+        hilos = medir_hilos(n, segundos)
+        procesos = medir_procesos(n, segundos)
+        print("%7d %16.0f %16.0f %8.2f" % (n, hilos, procesos, procesos / hilos if hilos else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark del camino por trama para la identidad de tags.
+
+Mide las funciones reales del camino caliente:
+  - lectura.RegistradorSigma._analisis_discriminatorio_tag (alta en la escena)
+  - captura.LectorRFID_dBm._decodificar (RSSI + EPC)
+contra la variante con clave EPC en str hex (`.hex().upper()`, version
+anterior a la clave int) aplicada sobre el mismo codigo.
+
+Por variante reporta:
+  - ns/trama: mediana y minimo de varias pasadas, alternando variantes
+  - B/trama transitorios: pico de tracemalloc por encima de lo vivo antes de
+    cada trama (asignaciones temporales: slices, str hex, int)
+  - B/trama y bloques/trama retenidos en regimen (escena ya poblada), por
+    tracemalloc y sys.getallocatedblocks()
+  - B retenidos por tag nuevo en la escena (solo lectura; captura no retiene)
+
+Los tiempos varian de una corrida a otra mas que la diferencia entre
+variantes en maquinas cargadas; comparar varias corridas.
+
+Uso: python bench_tags.py [n_tramas] [n_tags] [pasadas]
+"""
+import statistics
+import sys
+import time
+import tracemalloc
+import random
+
+import captura
+import lectura
+
+
+def _tramas(n_tramas, n_tags):
+    random.seed(1)
+    epcs = [bytes(random.getrandbits(8) for _ in range(12)) for _ in range(n_tags)]
+    # Notice 0x22: BB 02 22 00 11 RSSI PC(2) EPC(12) CRC(2) CS 7E
+    return [b"\xBB\x02\x22\x00\x11\xC4\x30\x00" + epcs[i % n_tags] + b"\x00\x00\x00\x7E"
+            for i in range(n_tramas)]
+
+
+class _RegistradorHex(lectura.RegistradorSigma):
+    """Mismo registrador con la clave de tag en str hex."""
+
+    def _analisis_discriminatorio_tag(self, trama, puerto=None):
+        if len(trama) >= 19 and trama[1] == 0x02:
+            segmento = trama[2:-1] if trama[-1] == 0x7E else trama[2:]
+            self._registrar_tag(segmento[6:18].hex().upper(), time.time(), puerto)
+
+
+def _decodificar_hex(trama):
+    # captura._decodificar anterior: slice de params y EPC en hex
+    pl = (trama[3] << 8) | trama[4]
+    params = trama[5:5 + pl]
+    rssi_raw = params[0]
+    rssi_dbm = rssi_raw - 256 if rssi_raw > 127 else rssi_raw
+    return params[3:3 + 12].hex().upper(), rssi_dbm
+
+
+def _variantes():
+    reg_hex = _RegistradorHex()
+    reg_int = lectura.RegistradorSigma()
+    return [
+        ("lectura", "hex", lambda t: reg_hex._analisis_discriminatorio_tag(t, "bench")),
+        ("lectura", "int", lambda t: reg_int._analisis_discriminatorio_tag(t, "bench")),
+        ("captura", "hex", _decodificar_hex),
+        ("captura", "int", captura.LectorRFID_dBm._decodificar),
+    ]
+
+
+def medir_tiempo(funcion, tramas):
+    t0 = time.perf_counter()
+    for trama in tramas:
+        funcion(trama)
+    return (time.perf_counter() - t0) / len(tramas) * 1e9
+
+
+def medir_asignaciones(funcion, tramas):
+    """(B transitorios/trama, B retenidos/trama, bloques retenidos/trama) con la escena ya poblada."""
+    for trama in tramas:
+        funcion(trama)
+    n = len(tramas)
+    tracemalloc.start()
+    transitorio = 0
+    bloques0 = sys.getallocatedblocks()
+    inicio = tracemalloc.get_traced_memory()[0]
+    for trama in tramas:
+        tracemalloc.reset_peak()
+        antes = tracemalloc.get_traced_memory()[0]
+        funcion(trama)
+        pico = tracemalloc.get_traced_memory()[1]
+        transitorio += pico - antes
+    final = tracemalloc.get_traced_memory()[0]
+    bloques = sys.getallocatedblocks() - bloques0
+    tracemalloc.stop()
+    return transitorio / n, (final - inicio) / n, bloques / n
+
+
+def medir_alta(funcion, tramas):
+    """B retenidos por trama cuando cada trama es un tag nuevo."""
+    tracemalloc.start()
+    inicio = tracemalloc.get_traced_memory()[0]
+    for trama in tramas:
+        funcion(trama)
+    final = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (final - inicio) / len(tramas)
+
+
+def main():
+    n_tramas = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    n_tags = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    pasadas = int(sys.argv[3]) if len(sys.argv) > 3 else 7
+    tramas = _tramas(n_tramas, n_tags)
+    variantes = _variantes()
+    print("%d tramas, %d tags distintos, %d pasadas" % (n_tramas, n_tags, pasadas))
+
+    tiempos = {(camino, clave): [] for camino, clave, _ in variantes}
+    for _ in range(pasadas):
+        for camino, clave, funcion in variantes:
+            tiempos[(camino, clave)].append(medir_tiempo(funcion, tramas))
+
+    muestra = tramas[:min(n_tramas, 20000)]
+    print("%-8s %-4s %10s %10s %14s %14s %12s" % ("camino", "clave", "ns med", "ns min",
+                                                  "B/trama trans", "B/trama ret", "bloq/trama"))
+    resumen = {}
+    for camino, clave, funcion in _variantes():
+        trans, ret, bloques = medir_asignaciones(funcion, muestra)
+        t = tiempos[(camino, clave)]
+        resumen[(camino, clave)] = statistics.median(t)
+        print("%-8s %-4s %10.1f %10.1f %14.1f %14.2f %12.3f" % (camino, clave, statistics.median(t), min(t),
+                                                               trans, ret, bloques))
+    altas = {clave: medir_alta(funcion, tramas[:n_tags]) for camino, clave, funcion in _variantes()
+             if camino == "lectura"}
+    print("lectura: %.0f B por tag nuevo (hex) vs %.0f B (int)" % (altas["hex"], altas["int"]))
+    for camino in ("lectura", "captura"):
+        print("%s: int vs hex %+.1f%% tiempo (mediana)" % (
+            camino, 100 * (resumen[(camino, "int")] / resumen[(camino, "hex")] - 1)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Calibracion automatica de parametros RF por lector.
+
+Con los tags de la puerta a la vista, barre potencia, canal y parametros de
+inventario (Q y sesion de Gen2) en cada puerto y mide, por punto:
+  - distintos_s: tags distintos por segundo
+  - duplicados:  fraccion de lecturas repetidas (1 - distintos / lecturas)
+
+El mejor punto es el de mas tags distintos por segundo; entre los que quedan
+a menos de TOLERANCIA_MEJOR del maximo se prefiere menos duplicados y luego
+menor potencia (menos alcance sobre puertas vecinas). El perfil se guarda en
+comandos.ARCHIVO_PERFILES y lectura.py / captura.py lo aplican al inicializar
+cada lector (comandos.parametros_inicio).
+
+Por defecto el barrido es por coordenadas (potencia, canal, Q, sesion, cada
+una con las demas fijas en el mejor valor hallado); --completo mide la
+grilla entera. Los puertos se calibran en paralelo. Los lectores no deben
+estar en uso por lectura.py / captura.py durante la calibracion.
+
+Uso:
+  python calibracion.py [--puertos /dev/ttyUSB0 ...] [--duracion 3] [--completo]
+  python calibracion.py --simulado 2      # contra lectores simulados (lector_simulado.py)
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from comandos import (ARCHIVO_PERFILES, CanalComandos, ErrorComando, REGION_US, trama_canal, trama_potencia,
+                      trama_query, trama_region)
+from proceso_lector import extraer_tramas
+
+GRILLA = {
+    "potencia": [18, 20, 22, 24, 26],
+    "canal": [0x00, 0x0D, 0x1A, 0x27, 0x31],
+    "q": [2, 3, 4, 5, 6],
+    "sesion": [0, 1],
+}
+INICIAL = {"potencia": 26, "canal": 0x1A, "q": 4, "sesion": 0}
+TOLERANCIA_MEJOR = 0.03
+DURACION = 3.0  # segundos de medicion por punto
+ASENTAMIENTO = 0.3  # segundos descartados tras reconfigurar
+
+
+class MedidorLector:
+    """Hilo lector de calibracion: entrega respuestas al CanalComandos y cuenta notificaciones."""
+
+    def __init__(self, ser, puerto):
+        self.ser = ser
+        self.puerto = puerto
+        self.canal = CanalComandos(ser, puerto)
+        self._activo = True
+        self._midiendo = False
+        self._lock = threading.Lock()
+        self._lecturas = 0
+        self._distintos = set()
+        self._hilo = threading.Thread(target=self._leer, daemon=True, name="calibracion-" + puerto)
+        self._hilo.start()
+
+    def _leer(self):
+        buffer = bytearray()
+        while self._activo:
+            chunk = self.ser.read(self.ser.in_waiting or 1)
+            if not chunk:
+                continue
+            buffer.extend(chunk)
+            notificaciones, respuestas, _ = extraer_tramas(buffer)
+            for trama in respuestas:
+                self.canal.procesar(trama)
+            if self._midiendo and notificaciones:
+                with self._lock:
+                    self._lecturas += len(notificaciones)
+                    self._distintos.update(epc for epc, _rssi in notificaciones)
+
+    def aplicar(self, punto, region=REGION_US):
+        """Detiene el inventario, aplica el punto con confirmacion y lo reanuda. False si el lector no acepta."""
+        try:
+            if self.canal.leyendo:
+                self.canal.detener_lectura()
+            for trama in (trama_region(region), trama_canal(punto["canal"]), trama_potencia(punto["potencia"]),
+                          trama_query(punto["q"], punto["sesion"])):
+                if self.canal.enviar(trama) is None:
+                    return False
+        except ErrorComando as e:
+            print("Calibracion %s: %s en %s" % (self.puerto, e, punto))
+            return False
+        finally:
+            self.canal.iniciar_lectura()
+        return True
+
+    def medir(self, punto, duracion=DURACION, asentamiento=ASENTAMIENTO):
+        resultado = dict(punto)
+        if not self.aplicar(punto):
+            resultado.update(lecturas=0, distintos=0, distintos_s=0.0, duplicados=1.0, valido=False)
+            return resultado
+        time.sleep(asentamiento)
+        with self._lock:
+            self._lecturas = 0
+            self._distintos = set()
+        self._midiendo = True
+        time.sleep(duracion)
+        self._midiendo = False
+        with self._lock:
+            lecturas, distintos = self._lecturas, len(self._distintos)
+        resultado.update(
+            lecturas=lecturas,
+            distintos=distintos,
+            distintos_s=round(distintos / duracion, 3),
+            duplicados=round(1 - distintos / lecturas, 4) if lecturas else 1.0,
+            valido=True,
+        )
+        return resultado
+
+    def cerrar(self):
+        try:
+            if self.canal.leyendo:
+                self.canal.detener_lectura()
+        except ErrorComando as e:
+            print("Calibracion %s: %s al detener" % (self.puerto, e))
+        finally:
+            self._activo = False
+            self._hilo.join(1.0)
+
+
+def mejor(resultados):
+    validos = [r for r in resultados if r["valido"] and r["lecturas"]]
+    if not validos:
+        return None
+    maximo = max(r["distintos_s"] for r in validos)
+    candidatos = [r for r in validos if r["distintos_s"] >= maximo * (1 - TOLERANCIA_MEJOR)]
+    return min(candidatos, key=lambda r: (r["duplicados"], r["potencia"]))
+
+
+def barrer(medidor, grilla=GRILLA, completo=False, duracion=DURACION, informar=None):
+    """Devuelve (mejor punto, todos los resultados) para un lector."""
+    medidos = {}
+
+    def medir(punto):
+        clave = tuple(sorted(punto.items()))
+        if clave not in medidos:
+            medidos[clave] = medidor.medir(punto, duracion)
+            if informar:
+                informar(medidor.puerto, medidos[clave])
+        return medidos[clave]
+
+    if completo:
+        claves = list(grilla)
+        for valores in itertools.product(*(grilla[c] for c in claves)):
+            medir(dict(zip(claves, valores)))
+    else:
+        base = dict(INICIAL)
+        for clave in ("potencia", "canal", "q", "sesion"):
+            ganador = mejor([medir(dict(base, **{clave: valor})) for valor in grilla[clave]])
+            if ganador is not None:
+                base[clave] = ganador[clave]
+    resultados = list(medidos.values())
+    return mejor(resultados), resultados
+
+
+def guardar_perfiles(perfiles, archivo=ARCHIVO_PERFILES):
+    """Actualiza el archivo de perfiles conservando los de puertos no calibrados ahora."""
+    existentes = {}
+    if os.path.exists(archivo):
+        with open(archivo) as f:
+            existentes = json.load(f)
+    existentes.update(perfiles)
+    temporal = archivo + ".tmp"
+    with open(temporal, "w") as f:
+        json.dump(existentes, f, indent=2, sort_keys=True)
+    os.replace(temporal, archivo)
+
+
+def calibrar(lectores, completo=False, duracion=DURACION, grilla=GRILLA):
+    """`lectores`: {puerto: (ser, clave_perfil)}. Devuelve {clave_perfil: perfil}."""
+    perfiles = {}
+    lock = threading.Lock()
+
+    def informar(puerto, r):
+        with lock:
+            print("%-14s pot=%4.1f canal=0x%02X q=%d s=%d -> %7.2f tags/s  dup=%5.1f%%  lecturas=%d%s" % (
+                puerto, r["potencia"], r["canal"], r["q"], r["sesion"], r["distintos_s"], r["duplicados"] * 100,
+                r["lecturas"], "" if r["valido"] else "  (rechazado)"))
+
+    def calibrar_puerto(puerto, ser, clave):
+        medidor = MedidorLector(ser, puerto)
+        try:
+            ganador, _ = barrer(medidor, grilla, completo, duracion, informar)
+        finally:
+            medidor.cerrar()
+        if ganador is None:
+            print("%s: sin lecturas validas, no se guarda perfil" % puerto)
+            return
+        perfil = {c: ganador[c] for c in ("potencia", "canal", "q", "sesion", "distintos_s", "duplicados")}
+        perfil["puerto"] = puerto
+        perfil["fecha"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with lock:
+            perfiles[clave] = perfil
+
+    hilos = [threading.Thread(target=calibrar_puerto, args=(puerto, ser, clave), daemon=True)
+             for puerto, (ser, clave) in lectores.items()]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return perfiles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calibracion de parametros RF por lector")
+    parser.add_argument("--puertos", nargs="+", help="por defecto todos los ttyUSB presentes")
+    parser.add_argument("--duracion", type=float, default=DURACION, help="segundos de medicion por punto")
+    parser.add_argument("--completo", action="store_true", help="grilla completa en vez de barrido por coordenadas")
+    parser.add_argument("--archivo", default=ARCHIVO_PERFILES)
+    parser.add_argument("--simulado", type=int, default=0, metavar="N", help="usar N lectores simulados")
+    parser.add_argument("--no-guardar", action="store_true")
+    args = parser.parse_args(argv)
+
+    lectores = {}
+    if args.simulado:
+        from lector_simulado import LectorSimulado
+        for i in range(args.simulado):
+            lectores["sim%d" % i] = (LectorSimulado(n_tags=30 + 10 * i, semilla=i), "sim%d" % i)
+    else:
+        import serial
+        from supervisor import listar_puertos, identificador_puerto
+        for puerto in args.puertos or listar_puertos():
+            lectores[puerto] = (serial.Serial(puerto, 115200, timeout=0.05), identificador_puerto(puerto))
+    if not lectores:
+        print("No hay lectores para calibrar")
+        return 1
+
+    try:
+        perfiles = calibrar(lectores, args.completo, args.duracion)
+    finally:
+        for ser, _ in lectores.values():
+            ser.close()
+
+    print()
+    for clave, p in sorted(perfiles.items()):
+        print("%s (%s): potencia %.1f dBm, canal 0x%02X, Q %d, sesion %d -> %.2f tags/s, %.1f%% duplicados" % (
+            p["puerto"], clave, p["potencia"], p["canal"], p["q"], p["sesion"], p["distintos_s"],
+            p["duplicados"] * 100))
+    if perfiles and not args.no_guardar:
+        guardar_perfiles(perfiles, args.archivo)
+        print("Perfiles guardados en " + args.archivo)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
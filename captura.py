@@ -1,70 +1,198 @@
 # -- coding: utf-8 --
 import serial
-import serial.tools.list_ports
 import time
 import threading
-import os
-import csv
 from datetime import datetime
 from queue import Queue, Full
 
-CMD_POTENCIA = bytes.fromhex("BB 00 B6 00 02 0A 28 EA 7E") # 26dBm
-CMD_REGION   = bytes.fromhex("BB 00 07 00 01 02 0A 7E")    # US Region
-CMD_FREQ     = bytes.fromhex("BB 00 AB 00 01 1A C6 7E")    # Canal RF
-CMD_LEER     = bytes.fromhex("BB 00 27 00 03 22 FF FF 4A 7E") # Lectura Continua
-CMD_STOP     = bytes.fromhex("BB 00 28 00 00 28 7E")
+from comandos import CanalComandos, REGION_US, CANAL_915_MHZ, TIPO_RESPUESTA, cargar_perfiles, parametros_inicio
+from metricas import REGISTRO
+from supervisor import SupervisorPuertos, listar_puertos
+from proceso_lector import GrupoProcesosLector
+from sumideros import Distribuidor, SumideroCSV, SumideroConsola, SumideroPostgres, a_rfid_raw_reads, CAMPO_T_LECTURA
+
+METRICAS_PUERTO_HTTP = 9108
+METRICAS_ARCHIVO = "metricas_captura.json"
+
+COLUMNAS_TRAMAS = ["Fecha", "Hora_MS", "Tag_ID", "Puerto", "RSSI_dBm"]
+# Hora_MS/RSSI_dBm de una pasada corresponden al pico de RSSI (mejor estimacion del paso por la antena)
+COLUMNAS_PASADAS = COLUMNAS_TRAMAS + ["Primera_MS", "Ultima_MS", "Lecturas", "RSSI_Medio"]
+
+
+def epc_hex(tid):
+    """EPC de 96 bits (int) a los 24 caracteres hex usados en CSV y consola."""
+    return format(tid, "024X")
+
+
+class Pasada:
+    """Estado O(1) de un tag frente a una antena mientras sigue siendo leido."""
+    __slots__ = ("tag_id", "puerto", "primera", "ultima", "conteo", "rssi_pico", "t_pico", "rssi_suma")
+
+    def __init__(self, tag_id, puerto, ts, rssi):
+        self.tag_id = tag_id
+        self.puerto = puerto
+        self.primera = ts
+        self.ultima = ts
+        self.conteo = 1
+        self.rssi_pico = rssi
+        self.t_pico = ts
+        self.rssi_suma = rssi
+
+    def actualizar(self, ts, rssi):
+        self.ultima = ts
+        self.conteo += 1
+        self.rssi_suma += rssi
+        if rssi > self.rssi_pico:
+            self.rssi_pico = rssi
+            self.t_pico = ts
+
+    @property
+    def rssi_medio(self):
+        return self.rssi_suma / self.conteo
+
+
+class AgregadorPasadas:
+    """Agrupa lecturas por (tag, puerto) y entrega la pasada cuando el tag queda en silencio."""
+
+    def __init__(self, silencio=1.0):
+        self.silencio = silencio
+        self._activas = {}
+        self._lock = threading.Lock()
+
+    def agregar(self, tag_id, puerto, ts, rssi):
+        clave = (tag_id, puerto)
+        with self._lock:
+            pasada = self._activas.get(clave)
+            if pasada is None:
+                self._activas[clave] = Pasada(tag_id, puerto, ts, rssi)
+            else:
+                pasada.actualizar(ts, rssi)
+
+    def cerrar(self, ahora=None):
+        """Retira y devuelve, ordenadas por pico, las pasadas sin lecturas en `silencio` s (todas si ahora es None)."""
+        with self._lock:
+            if ahora is None:
+                cerradas = list(self._activas.values())
+                self._activas.clear()
+            else:
+                limite = ahora - self.silencio
+                cerradas = [p for p in self._activas.values() if p.ultima < limite]
+                for p in cerradas:
+                    del self._activas[(p.tag_id, p.puerto)]
+        cerradas.sort(key=lambda p: p.t_pico)
+        return cerradas
+
+    def __len__(self):
+        return len(self._activas)
+
 
 class LectorRFID_dBm:
-    def __init__(self):
-        self.archivo_log = "reporte_dbm_real.csv"
-        self.lock = threading.Lock()
+    def __init__(self, modo_pasadas=False):
+        self.modo_pasadas = modo_pasadas
+        self.archivo_log = "reporte_pasadas.csv" if modo_pasadas else "reporte_dbm_real.csv"
         self.running = False
         self.seriales = []
+        self.canales = {}  # puerto -> CanalComandos (reconfiguracion en caliente)
+        self.supervisor = None
+        self.region = REGION_US
+        self.canal_rf = CANAL_915_MHZ
+        self.potencia_dbm = 26
+        # Perfil calibrado por puerto (calibracion.py); los puertos sin perfil usan los valores de arriba
+        self.perfiles_rf = cargar_perfiles()
+        # Modo proceso-por-lector: cada puerto en su propio proceso, tags por memoria compartida
+        self.modo_procesos = False
+        self.procesos = None
+        self._pasadas = AgregadorPasadas()
+        self.silencio_pasada = 1.0  # Segundos sin lecturas para cerrar la pasada de un tag
 
         # NEW
         self._q = Queue(maxsize=5000)
-
-        if not os.path.exists(self.archivo_log):
-            with open(self.archivo_log, "a", newline='') as f:
-                csv.writer(f).writerow(["Fecha", "Hora_MS", "Tag_ID", "Puerto", "RSSI_dBm"])
+        REGISTRO.gauge("captura_cola_profundidad", "Tramas en espera de persistir", funcion=self._q.qsize)
+        self._m_guardar = REGISTRO.histograma("captura_guardar_segundos", "Duracion de _guardar_dato")
+        self._m_espera = REGISTRO.histograma("captura_cola_espera_segundos", "Desde la lectura de la trama hasta salir de la cola",
+                                             buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+        if modo_pasadas:
+            REGISTRO.gauge("captura_pasadas_activas", "Pasadas abiertas", funcion=lambda: len(self._pasadas))
+            self._m_pasadas = REGISTRO.contador("captura_pasadas_total", "Pasadas emitidas")
+
+        # Sumideros adicionales (Postgres, SQLite...) ademas del CSV y la consola
+        self.sumideros_extra = []
+        self.distribuidor = None
+
+    @property
+    def silencio_pasada(self):
+        return self._pasadas.silencio
+
+    @silencio_pasada.setter
+    def silencio_pasada(self, segundos):
+        # El agregador lee el valor en cada cierre: se puede ajustar con la captura en marcha
+        self._pasadas.silencio = segundos
+
+    def _crear_distribuidor(self):
+        if self.modo_pasadas:
+            consola = SumideroConsola(lambda r: f"[{r['Hora_MS']}] PASADA: {r['Tag_ID']} | PICO: {r['RSSI_dBm']} dBm | "
+                                                f"LECTURAS: {r['Lecturas']} | puerto: {r['Puerto']}")
+        else:
+            consola = SumideroConsola(lambda r: f"[{r['Hora_MS']}] TAG: {r['Tag_ID']} | POTENCIA: {r['RSSI_dBm']} dBm | "
+                                                f"puerto: {r['Puerto']}")
+        columnas = COLUMNAS_PASADAS if self.modo_pasadas else COLUMNAS_TRAMAS
+        return Distribuidor([SumideroCSV(self.archivo_log, columnas), consola] + list(self.sumideros_extra))
 
     @staticmethod
     def _calc_checksum(frame: bytes) -> int:
         return sum(frame[1:-2]) & 0xFF
 
     def start(self):
-        puertos = [p.device for p in serial.tools.list_ports.comports() if 'ttyUSB' in p.device]
-        if not puertos:
-            print(">>> ERROR: No se detectan sensores YRM1001 en los puertos USB.")
-            return False
+        if not listar_puertos():
+            print(">>> AVISO: No se detectan sensores YRM1001 en los puertos USB, esperando conexion.")
 
         self.running = True
+        self.distribuidor = self._crear_distribuidor()
 
         # NEW worker
         threading.Thread(target=self._worker_guardar, daemon=True).start()
 
-        for p in puertos:
-            t = threading.Thread(target=self._hilo_lector, args=(p,), daemon=True)
-            t.start()
+        # Un hilo por puerto, relanzado por el supervisor si el lector se desconecta
+        objetivo = self._hilo_lector
+        if self.modo_procesos:
+            self.procesos = GrupoProcesosLector(self.region, self.canal_rf, self.potencia_dbm, perfiles=self.perfiles_rf)
+            self.procesos.activo = True
+            objetivo = self.procesos.ejecutar
+            threading.Thread(target=self.procesos.drenar, args=(self._entregar_lote,), daemon=True).start()
+        self.supervisor = SupervisorPuertos(objetivo, nombre="captura")
+        self.supervisor.start()
 
         print(f">>> SISTEMA ACTIVO: Capturando datos en {self.archivo_log}")
         print(">>> Presiona Ctrl+C para detener y guardar.")
         return True
 
     def _hilo_lector(self, puerto):
+        """Los errores de E/S se propagan al supervisor, que relanza el hilo."""
+        ser = serial.Serial(puerto, 115200, timeout=0.05)
+        self.seriales.append(ser)
+        canal = CanalComandos(ser, puerto)
+        self.canales[puerto] = canal
         try:
-            ser = serial.Serial(puerto, 115200, timeout=0.05)
-            self.seriales.append(ser)
+            # Las respuestas se procesan en este hilo, la secuencia de inicio corre aparte
+            rf = parametros_inicio(self.perfiles_rf, puerto, self.region, self.canal_rf, self.potencia_dbm)
+            threading.Thread(target=canal.inicializar, kwargs=rf, daemon=True).start()
 
-            for cmd in [CMD_REGION, CMD_FREQ, CMD_POTENCIA, CMD_LEER]:
-                ser.write(cmd)
-                time.sleep(0.1)
+            m_tramas = REGISTRO.contador("captura_tramas_total", "Tramas validas", puerto=puerto)
+            m_checksum = REGISTRO.contador("captura_checksum_fallidos_total", "Tramas con checksum invalido", puerto=puerto)
+            m_descartes = REGISTRO.contador("captura_cola_llena_total", "Tramas descartadas por cola llena", puerto=puerto)
+            m_bytes = REGISTRO.contador("captura_bytes_total", "Bytes leidos del puerto", puerto=puerto)
 
             buffer = bytearray()
 
             while self.running:
                 chunk = ser.read(ser.in_waiting or 1)
                 if chunk:
+                    # Las tramas que se completan con este bloque llevan su instante de lectura:
+                    # hora de pared para el registro y monotonica para latencias y pasadas
+                    t_pared = time.time()
+                    t_lectura = time.monotonic()
+                    m_bytes.inc(len(chunk))
                     buffer.extend(chunk)
 
                 while True:
@@ -90,66 +218,156 @@ class LectorRFID_dBm:
                         continue
 
                     if self._calc_checksum(trama) != trama[-2]:
+                        m_checksum.inc()
+                        continue
+
+                    m_tramas.inc()
+
+                    if trama[1] == TIPO_RESPUESTA:
+                        canal.procesar(trama)
                         continue
 
                     # Solo Notice + Cmd 0x22 = tag leído
                     if trama[1] == 0x02 and trama[2] == 0x22:
+                        tag_id, rssi_dbm = self._decodificar(trama)
                         try:
-                            self._q.put_nowait((trama, puerto))
+                            self._q.put_nowait((tag_id, rssi_dbm, puerto, t_pared, t_lectura))
                         except Full:
-                            pass
+                            m_descartes.inc()
+        finally:
+            if self.canales.get(puerto) is canal:
+                del self.canales[puerto]
+            if ser in self.seriales:
+                self.seriales.remove(ser)
+            try:
+                ser.close()
+            except Exception:
+                pass
 
-        except Exception as e:
-            print(f"Error en puerto {puerto}: {e}")
+    def _entregar_lote(self, puerto, lote):
+        """Consumidor del modo proceso: lleva las notificaciones del anillo a la cola de escritura."""
+        m_tramas = REGISTRO.contador("captura_tramas_total", "Tramas validas", puerto=puerto)
+        m_tramas.inc(len(lote))
+        # El proceso lector marca con hora de pared al leer; la monotonica se deriva con el
+        # desfase actual entre relojes (un salto de NTP entre lectura y entrega es despreciable)
+        desfase = time.time() - time.monotonic()
+        for ts, epc, rssi_dbm in lote:
+            try:
+                self._q.put_nowait((int.from_bytes(epc, "big"), rssi_dbm, puerto, ts, ts - desfase))
+            except Full:
+                REGISTRO.contador("captura_cola_llena_total", "Tramas descartadas por cola llena", puerto=puerto).inc()
 
     def _worker_guardar(self):
+        # Las pasadas se agregan y se cierran en la escala monotonica (un salto de NTP no
+        # adelanta ni retiene cierres); la hora de pared se aplica al emitirlas
+        proximo_cierre = 0.0
         while self.running or not self._q.empty():
+            ahora = time.monotonic()
+            if self.modo_pasadas and ahora >= proximo_cierre:
+                self._emitir_pasadas(ahora)
+                proximo_cierre = ahora + 0.1
             try:
-                trama, puerto = self._q.get(timeout=0.2)
+                tag_id, rssi_dbm, puerto, t_pared, t_lectura = self._q.get(timeout=0.1 if self.modo_pasadas else 0.2)
             except:
                 continue
             try:
-                self._guardar_dato(trama, puerto)
+                self._m_espera.observar(time.monotonic() - t_lectura)
+                with self._m_guardar.tiempo():
+                    if self.modo_pasadas:
+                        self._pasadas.agregar(tag_id, puerto, t_lectura, rssi_dbm)
+                    else:
+                        self._guardar_dato(tag_id, rssi_dbm, puerto, t_pared, t_lectura)
             finally:
                 self._q.task_done()
 
-    def _guardar_dato(self, trama, puerto):
-        ahora = datetime.now()
-
-        pl = (trama[3] << 8) | trama[4]
-        params = trama[5:5+pl]
-
-        rssi_raw = params[0]
+    @staticmethod
+    def _decodificar(trama):
+        """Devuelve (EPC como int, RSSI dBm); la conversion a hex se hace solo al escribir."""
+        # params = trama[5:5+PL]; RSSI = params[0], EPC = params[3:15] cuando PL=0x11
+        rssi_raw = trama[5]
         rssi_dbm = rssi_raw - 256 if rssi_raw > 127 else rssi_raw
 
-        # EPC = params[3:15] cuando PL=0x11
-        tag_id = params[3:3+12].hex().upper()
-
-        h_ms = ahora.strftime('%H:%M:%S.%f')[:-3]
-
-        with self.lock:
-            with open(self.archivo_log, "a", newline='') as f:
-                csv.writer(f).writerow([ahora.strftime('%Y-%m-%d'), h_ms, tag_id, puerto, rssi_dbm])
-
-        print(f"[{h_ms}] TAG: {tag_id} | POTENCIA: {rssi_dbm} dBm | puerto: {puerto}")    
+        tag_id = int.from_bytes(trama[8:20], "big")
+        return tag_id, rssi_dbm
+
+    def _emitir_pasadas(self, ahora=None):
+        cerradas = self._pasadas.cerrar(ahora)
+        if not cerradas:
+            return
+
+        # Las marcas de la pasada son monotonicas; se llevan a hora de pared con el desfase actual
+        desfase = time.time() - time.monotonic()
+
+        def _hms(ts):
+            return datetime.fromtimestamp(ts + desfase).strftime('%H:%M:%S.%f')[:-3]
+
+        for p in cerradas:
+            self.distribuidor.publicar({
+                "Fecha": datetime.fromtimestamp(p.t_pico + desfase).strftime('%Y-%m-%d'),
+                "Hora_MS": _hms(p.t_pico),
+                "Tag_ID": epc_hex(p.tag_id),
+                "Puerto": p.puerto,
+                "RSSI_dBm": p.rssi_pico,
+                "Primera_MS": _hms(p.primera),
+                "Ultima_MS": _hms(p.ultima),
+                "Lecturas": p.conteo,
+                "RSSI_Medio": round(p.rssi_medio, 1),
+                CAMPO_T_LECTURA: p.ultima,
+            })
+        self._m_pasadas.inc(len(cerradas))
+
+    def _guardar_dato(self, tag_id, rssi_dbm, puerto, t_pared, t_lectura):
+        """`t_pared` y `t_lectura` son time.time() y time.monotonic() del bloque de bytes que completo la trama."""
+        ts = datetime.fromtimestamp(t_pared)
+        self.distribuidor.publicar({
+            "Fecha": ts.strftime('%Y-%m-%d'),
+            "Hora_MS": ts.strftime('%H:%M:%S.%f')[:-3],
+            "Tag_ID": epc_hex(tag_id),
+            "Puerto": puerto,
+            "RSSI_dBm": rssi_dbm,
+            CAMPO_T_LECTURA: t_lectura,
+        })
 
     def stop(self):
+        # Se detiene el inventario mientras los hilos lectores siguen vivos para recibir la confirmacion
+        for canal in list(self.canales.values()):
+            try:
+                canal.detener_lectura()
+            except:
+                pass
+
         self.running = False
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        if self.procesos is not None:
+            self.procesos.activo = False
         try:
             self._q.join()
         except:
             pass
 
-        for s in self.seriales:
+        if self.modo_pasadas:
+            self._emitir_pasadas()
+
+        for s in list(self.seriales):
             try:
-                s.write(CMD_STOP)
                 s.close()
             except:
                 pass
+
+        if self.distribuidor is not None:
+            self.distribuidor.cerrar()
         print("\n>>> Captura finalizada. Archivo guardado.")
 
 if __name__ == "__main__":
-    app = LectorRFID_dBm()
+    import sys
+    app = LectorRFID_dBm(modo_pasadas="--pasadas" in sys.argv)
+    app.modo_procesos = "--procesos" in sys.argv
+    if "--postgres" in sys.argv:
+        # Reemplaza el camino separado de rfiduhf para poblar rfid_raw_reads
+        app.sumideros_extra.append(SumideroPostgres("rfid_raw_reads", ["fecha", "epc_hex", "tag_id"], a_rfid_raw_reads))
+    REGISTRO.iniciar_http(METRICAS_PUERTO_HTTP)
+    REGISTRO.iniciar_instantaneas(METRICAS_ARCHIVO)
     if app.start():
         try:
             while True:
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Capa de comandos con confirmacion para lectores UHF YRM1001 (protocolo M100).
+
+Trama: BB | Tipo | Cmd | PL(2) | Params | Checksum | 7E
+  Tipo 0x00 = comando, 0x01 = respuesta, 0x02 = notificacion (tag leido).
+  Checksum = suma(Tipo..Params) & 0xFF.
+  Un error se responde con Tipo 0x01 y Cmd 0xFF (Params = codigo de error).
+
+El hilo lector sigue siendo el unico que lee el puerto: entrega cada trama de
+respuesta a CanalComandos.procesar() y el hilo que envio el comando despierta
+en cuanto llega la confirmacion, sin esperas fijas.
+"""
+import json
+import os
+import threading
+import time
+
+from metricas import REGISTRO
+
+TIPO_COMANDO = 0x00
+TIPO_RESPUESTA = 0x01
+TIPO_NOTIFICACION = 0x02
+
+CMD_QUERY = 0x0E
+CMD_REGION = 0x07
+CMD_INVENTARIO_MULTIPLE = 0x27
+CMD_DETENER_MULTIPLE = 0x28
+CMD_CANAL = 0xAB
+CMD_POTENCIA = 0xB6
+CMD_ERROR = 0xFF
+
+# Durante el inventario multiple el modulo responde BB 01 FF 00 01 15 16 7E en cada ronda sin
+# tags: es estado del inventario, no la respuesta a un comando
+ERROR_SIN_TAG = 0x15
+
+REGION_US = 0x02
+CANAL_915_MHZ = 0x1A  # 902.25 MHz + 0x1A * 0.5 MHz (region US)
+
+TIMEOUT_RESPUESTA = 0.5  # segundos
+
+# Perfiles RF por puerto escritos por calibracion.py y aplicados al inicializar cada lector
+ARCHIVO_PERFILES = "perfil_rf.json"
+
+
+def armar_trama(cmd, params=b""):
+    cuerpo = bytes([TIPO_COMANDO, cmd, (len(params) >> 8) & 0xFF, len(params) & 0xFF]) + bytes(params)
+    return b"\xBB" + cuerpo + bytes([sum(cuerpo) & 0xFF]) + b"\x7E"
+
+
+def trama_region(region=REGION_US):
+    return armar_trama(CMD_REGION, [region])
+
+
+def trama_canal(canal=CANAL_915_MHZ):
+    return armar_trama(CMD_CANAL, [canal])
+
+
+def trama_potencia(dbm=26):
+    centi = int(round(dbm * 100))
+    return armar_trama(CMD_POTENCIA, [(centi >> 8) & 0xFF, centi & 0xFF])
+
+
+def trama_query(q=4, sesion=0, target=0, trext=1, dr=0, m=0, sel=0):
+    """Parametros Query de Gen2: DR | M(2) | TRext | Sel(2) | Session(2) | Target | Q(4) | 000."""
+    valor = (dr << 15) | (m << 13) | (trext << 12) | (sel << 10) | (sesion << 8) | (target << 7) | (q << 3)
+    return armar_trama(CMD_QUERY, [(valor >> 8) & 0xFF, valor & 0xFF])
+
+
+def trama_inventario(repeticiones=0xFFFF):
+    return armar_trama(CMD_INVENTARIO_MULTIPLE, [0x22, (repeticiones >> 8) & 0xFF, repeticiones & 0xFF])
+
+
+def trama_detener():
+    return armar_trama(CMD_DETENER_MULTIPLE)
+
+
+class ErrorComando(Exception):
+    """El lector respondio con una trama de error (Cmd 0xFF)."""
+
+    def __init__(self, cmd, codigo):
+        Exception.__init__(self, "comando 0x%02X rechazado, codigo 0x%02X" % (cmd, codigo))
+        self.cmd = cmd
+        self.codigo = codigo
+
+
+class _Pendiente:
+    __slots__ = ("evento", "respuesta", "error")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.respuesta = None
+        self.error = None
+
+
+class CanalComandos:
+    """Envio de comandos con espera de respuesta sobre un puerto ya abierto."""
+
+    def __init__(self, ser, puerto=""):
+        self.ser = ser
+        self.puerto = puerto
+        self.leyendo = False
+        self._pendientes = {}
+        self._orden = []  # cmds pendientes en orden de envio, para asignar errores
+        self._lock = threading.Lock()
+        self._lock_escritura = threading.Lock()
+        self._m_ack = REGISTRO.histograma("lector_ack_segundos", "Latencia comando-respuesta", puerto=puerto)
+        self._m_timeouts = REGISTRO.contador("lector_ack_timeouts_total", "Comandos sin respuesta", puerto=puerto)
+
+    # ----------------------------------------
+    # LADO DEL HILO LECTOR
+    # ----------------------------------------
+    def procesar(self, trama):
+        """Entrega una trama de respuesta al comando que la espera. True si se consumio."""
+        if len(trama) < 7 or trama[1] != TIPO_RESPUESTA:
+            return False
+        cmd = trama[2]
+        params = bytes(trama[5:-2])
+        with self._lock:
+            if cmd == CMD_ERROR:
+                if not self._orden or (params and params[0] == ERROR_SIN_TAG):
+                    return True
+                cmd = self._orden[0]
+                pendiente = self._pendientes.pop(cmd)
+                pendiente.error = ErrorComando(cmd, params[0] if params else 0)
+            else:
+                pendiente = self._pendientes.pop(cmd, None)
+                if pendiente is None:
+                    return True
+                pendiente.respuesta = params
+            self._orden.remove(cmd)
+        pendiente.evento.set()
+        return True
+
+    # ----------------------------------------
+    # LADO DEL QUE CONTROLA
+    # ----------------------------------------
+    def enviar(self, trama, esperar=True, timeout=TIMEOUT_RESPUESTA):
+        """Escribe la trama y, si `esperar`, bloquea hasta su respuesta.
+
+        Devuelve los params de la respuesta, o None si vence el timeout.
+        Lanza ErrorComando si el lector responde con error.
+        """
+        cmd = trama[2]
+        if not esperar:
+            with self._lock_escritura:
+                self.ser.write(trama)
+            return None
+
+        pendiente = _Pendiente()
+        with self._lock:
+            if cmd in self._pendientes:
+                raise RuntimeError("ya hay un comando 0x%02X en curso en %s" % (cmd, self.puerto))
+            self._pendientes[cmd] = pendiente
+            self._orden.append(cmd)
+
+        t0 = time.perf_counter()
+        with self._lock_escritura:
+            self.ser.write(trama)
+        if not pendiente.evento.wait(timeout):
+            with self._lock:
+                if self._pendientes.get(cmd) is pendiente:
+                    del self._pendientes[cmd]
+                    self._orden.remove(cmd)
+            self._m_timeouts.inc()
+            return None
+        self._m_ack.observar(time.perf_counter() - t0)
+        if pendiente.error is not None:
+            raise pendiente.error
+        return pendiente.respuesta
+
+    def _configurar(self, trama):
+        """Los modulos M100 ignoran configuracion durante inventario multiple: se detiene y se reanuda."""
+        reanudar = self.leyendo
+        try:
+            if reanudar:
+                self.detener_lectura()
+            return self.enviar(trama)
+        finally:
+            if reanudar:
+                self.iniciar_lectura()
+
+    def inicializar(self, region=REGION_US, canal=CANAL_915_MHZ, potencia=26, query=None):
+        """Secuencia de arranque; cada paso avanza en cuanto el lector confirma.
+
+        `query` (dict con q, sesion...) configura tambien los parametros de inventario.
+        """
+        t0 = time.time()
+        ok = True
+        # Si el hilo lector se relanzo tras un error el modulo puede seguir en inventario multiple,
+        # donde ignora la configuracion: se detiene primero (sin respuesta no es un fallo)
+        self.leyendo = False
+        try:
+            self.enviar(trama_detener())
+        except ErrorComando:
+            pass
+        tramas = [trama_region(region), trama_canal(canal), trama_potencia(potencia)]
+        if query:
+            tramas.append(trama_query(**query))
+        for trama in tramas:
+            try:
+                if self.enviar(trama) is None:
+                    ok = False
+                    print("Lector %s: sin respuesta a 0x%02X" % (self.puerto, trama[2]))
+            except ErrorComando as e:
+                ok = False
+                print("Lector %s: %s" % (self.puerto, e))
+        self.iniciar_lectura()
+        REGISTRO.gauge("lector_inicio_segundos", "Duracion de la inicializacion", puerto=self.puerto).set(time.time() - t0)
+        return ok
+
+    def fijar_potencia(self, dbm):
+        return self._configurar(trama_potencia(dbm))
+
+    def fijar_canal(self, canal):
+        return self._configurar(trama_canal(canal))
+
+    def fijar_region(self, region):
+        return self._configurar(trama_region(region))
+
+    def fijar_query(self, q=4, sesion=0, target=0):
+        return self._configurar(trama_query(q, sesion, target))
+
+    def iniciar_lectura(self, repeticiones=0xFFFF):
+        # El inventario multiple no tiene respuesta propia: confirma con notificaciones de tags
+        self.enviar(trama_inventario(repeticiones), esperar=False)
+        self.leyendo = True
+
+    def detener_lectura(self):
+        self.leyendo = False
+        return self.enviar(trama_detener())
+
+
+# ----------------------------------------
+# PERFILES RF POR PUERTO
+# ----------------------------------------
+def cargar_perfiles(archivo=ARCHIVO_PERFILES):
+    """{clave de puerto: perfil}; vacio si no se ha calibrado."""
+    if not os.path.exists(archivo):
+        return {}
+    try:
+        with open(archivo) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print("Perfiles RF: no se pudo leer %s: %r" % (archivo, e))
+        return {}
+
+
+def parametros_inicio(perfiles, puerto, region=REGION_US, canal=CANAL_915_MHZ, potencia=26):
+    """Argumentos de CanalComandos.inicializar para `puerto`, con su perfil calibrado si existe.
+
+    El perfil se busca por identificador USB (numero de serie o ubicacion,
+    estable frente a re-enumeraciones) y luego por ruta del dispositivo.
+    """
+    parametros = {"region": region, "canal": canal, "potencia": potencia}
+    if not perfiles:
+        return parametros
+    from supervisor import identificador_puerto
+    perfil = perfiles.get(identificador_puerto(puerto)) or perfiles.get(puerto)
+    if perfil:
+        parametros["canal"] = perfil.get("canal", canal)
+        parametros["potencia"] = perfil.get("potencia", potencia)
+        if "q" in perfil:
+            parametros["query"] = {"q": perfil["q"], "sesion": perfil.get("sesion", 0)}
+    return parametros
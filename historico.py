@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Historico local indexado de lecturas RFID (SQLite).
+
+Carga en bloque los CSV de captura (reporte_dbm_real.csv, reporte_pasadas.csv,
+reporte_limpio.csv) y responde consultas por rango de tiempo, por tag y
+estadisticas por puerto usando indices, sin recorrer los CSV.
+
+La ingesta es incremental: por cada archivo se guarda el byte hasta el que
+se cargo, asi que puede correr periodicamente sobre archivos que siguen
+creciendo.
+
+Uso:
+  python historico.py ingerir reporte_dbm_real.csv [mas.csv ...]
+  python historico.py rango "2026-10-12 06:00" "2026-10-12 18:00" [--puerto /dev/ttyUSB0]
+  python historico.py tag E28011700000020F1234ABCD [--desde ...] [--hasta ...]
+  python historico.py puertos [--desde ...] [--hasta ...]
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+ARCHIVO_DB = "historico_rfid.db"
+LOTE_INSERCION = 50000
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS lecturas (
+    ts       REAL    NOT NULL,   -- epoch (hora local del equipo)
+    tag      TEXT    NOT NULL,
+    puerto   TEXT,
+    rssi     INTEGER,
+    lecturas INTEGER NOT NULL DEFAULT 1,
+    archivo  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_lecturas_ts ON lecturas (ts);
+CREATE INDEX IF NOT EXISTS ix_lecturas_tag_ts ON lecturas (tag, ts);
+CREATE INDEX IF NOT EXISTS ix_lecturas_puerto_ts ON lecturas (puerto, ts);
+-- Resumen por dia/puerto/tag para estadisticas sobre dias completos sin recorrer lecturas
+CREATE TABLE IF NOT EXISTS resumen_diario (
+    dia       TEXT    NOT NULL,
+    puerto    TEXT    NOT NULL,
+    tag       TEXT    NOT NULL,
+    filas     INTEGER NOT NULL,
+    lecturas  INTEGER NOT NULL,
+    rssi_suma INTEGER NOT NULL,
+    rssi_n    INTEGER NOT NULL,
+    primera   REAL    NOT NULL,
+    ultima    REAL    NOT NULL,
+    PRIMARY KEY (dia, puerto, tag)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS archivos (
+    id       INTEGER PRIMARY KEY,
+    ruta     TEXT UNIQUE NOT NULL,
+    offset   INTEGER NOT NULL DEFAULT 0,
+    columnas TEXT
+);
+"""
+
+_inicio_hora = {}
+
+
+def _a_epoch(fecha, hora):
+    """'YYYY-mm-dd' + 'HH:MM:SS[.mmm]' a epoch local.
+
+    strptime por fila domina la ingesta; se cachea el epoch del inicio de cada
+    hora (los cambios de horario ocurren en limites de hora) y se suma el resto.
+    """
+    clave = (fecha, hora[:2])
+    base = _inicio_hora.get(clave)
+    if base is None:
+        base = datetime.strptime(fecha + " " + hora[:2], "%Y-%m-%d %H").timestamp()
+        _inicio_hora[clave] = base
+    if hora[2] != ":" or hora[5] != ":":
+        raise ValueError("hora invalida: " + hora)
+    return base + int(hora[3:5]) * 60 + float(hora[6:])
+
+
+def _parsear_fecha(texto):
+    """Acepta 'YYYY-mm-dd', 'YYYY-mm-dd HH:MM[:SS]' o epoch."""
+    if texto is None:
+        return None
+    try:
+        return float(texto)
+    except ValueError:
+        pass
+    for formato in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(texto, formato).timestamp()
+        except ValueError:
+            continue
+    raise ValueError("fecha invalida: " + texto)
+
+
+class HistoricoRFID:
+    def __init__(self, archivo_db=ARCHIVO_DB):
+        self.conn = sqlite3.connect(archivo_db)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(ESQUEMA)
+
+    def cerrar(self):
+        self.conn.close()
+
+    # ----------------------------------------
+    # INGESTA
+    # ----------------------------------------
+    def ingerir_csv(self, ruta):
+        """Carga las filas nuevas de `ruta` desde la ultima ingesta. Devuelve filas insertadas."""
+        ruta = os.path.abspath(ruta)
+        fila = self.conn.execute("SELECT id, offset, columnas FROM archivos WHERE ruta=?", (ruta,)).fetchone()
+        if fila is None:
+            with self.conn:
+                cur = self.conn.execute("INSERT INTO archivos (ruta) VALUES (?)", (ruta,))
+            archivo_id, offset, columnas = cur.lastrowid, 0, None
+        else:
+            archivo_id, offset, columnas = fila
+
+        # Se recorre por bloques de lineas: memoria acotada aunque el CSV pese GB. Cada bloque
+        # se inserta junto con su offset en la misma transaccion, asi una ingesta interrumpida
+        # continua desde el ultimo bloque confirmado sin duplicar filas
+        insertadas = 0
+        extraer = self._extractor(columnas) if columnas is not None else None
+        lineas = []
+        with open(ruta, "rb") as f:
+            f.seek(offset)
+            for linea in f:
+                # Solo lineas completas: la ultima puede estar a medio escribir
+                if not linea.endswith(b"\n"):
+                    break
+                offset += len(linea)
+                if extraer is None:
+                    columnas = ",".join(next(csv.reader([linea.decode("latin-1")])))
+                    extraer = self._extractor(columnas)
+                    continue
+                lineas.append(linea.decode("latin-1"))
+                if len(lineas) >= LOTE_INSERCION:
+                    insertadas += self._insertar(self._filas(lineas, extraer, archivo_id), archivo_id, offset, columnas)
+                    lineas = []
+        if columnas is not None:
+            insertadas += self._insertar(self._filas(lineas, extraer, archivo_id), archivo_id, offset, columnas)
+        return insertadas
+
+    @staticmethod
+    def _filas(lineas, extraer, archivo_id):
+        filas = []
+        for campos in csv.reader(lineas):
+            try:
+                filas.append(extraer(campos) + (archivo_id,))
+            except (ValueError, IndexError):
+                continue
+        return filas
+
+    @staticmethod
+    def _extractor(columnas):
+        indices = {c: i for i, c in enumerate(columnas.split(","))}
+        i_fecha = indices["Fecha"]
+        i_hora = indices["Hora_MS"] if "Hora_MS" in indices else indices["Hora"]
+        i_tag = indices["Tag_ID"]
+        i_puerto = indices.get("Puerto")
+        i_rssi = indices.get("RSSI_dBm")
+        i_lecturas = indices.get("Lecturas")
+
+        def extraer(c):
+            return (
+                _a_epoch(c[i_fecha], c[i_hora]),
+                c[i_tag],
+                c[i_puerto] if i_puerto is not None else None,
+                int(c[i_rssi]) if i_rssi is not None else None,
+                int(c[i_lecturas]) if i_lecturas is not None else 1,
+            )
+        return extraer
+
+    def _insertar(self, lote, archivo_id, offset, columnas):
+        """Inserta el lote y avanza el offset del archivo en una sola transaccion."""
+        resumen = {}
+        dias = {}  # hora (epoch // 3600) -> dia local
+        for ts, tag, puerto, rssi, lecturas, _ in lote:
+            hora = int(ts // 3600)
+            dia = dias.get(hora)
+            if dia is None:
+                dia = dias[hora] = datetime.fromtimestamp(hora * 3600).strftime("%Y-%m-%d")
+            clave = (dia, puerto or "", tag)
+            r = resumen.get(clave)
+            if r is None:
+                resumen[clave] = [1, lecturas, rssi or 0, 0 if rssi is None else 1, ts, ts]
+            else:
+                r[0] += 1
+                r[1] += lecturas
+                if rssi is not None:
+                    r[2] += rssi
+                    r[3] += 1
+                if ts < r[4]:
+                    r[4] = ts
+                if ts > r[5]:
+                    r[5] = ts
+        with self.conn:
+            self.conn.execute("UPDATE archivos SET offset=?, columnas=? WHERE id=?", (offset, columnas, archivo_id))
+            self.conn.executemany(
+                "INSERT INTO lecturas (ts, tag, puerto, rssi, lecturas, archivo) VALUES (?, ?, ?, ?, ?, ?)", lote)
+            self.conn.executemany(
+                "INSERT INTO resumen_diario VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (dia, puerto, tag) DO UPDATE SET filas = filas + excluded.filas, "
+                "lecturas = lecturas + excluded.lecturas, rssi_suma = rssi_suma + excluded.rssi_suma, "
+                "rssi_n = rssi_n + excluded.rssi_n, primera = min(primera, excluded.primera), "
+                "ultima = max(ultima, excluded.ultima)",
+                [k + tuple(v) for k, v in resumen.items()])
+        return len(lote)
+
+    # ----------------------------------------
+    # CONSULTAS
+    # ----------------------------------------
+    def rango(self, desde, hasta, puerto=None, limite=10000):
+        sql = "SELECT ts, tag, puerto, rssi, lecturas FROM lecturas WHERE ts >= ? AND ts < ?"
+        params = [desde, hasta]
+        if puerto:
+            sql = "SELECT ts, tag, puerto, rssi, lecturas FROM lecturas WHERE puerto = ? AND ts >= ? AND ts < ?"
+            params = [puerto, desde, hasta]
+        sql += " ORDER BY ts LIMIT ?"
+        return self.conn.execute(sql, params + [limite]).fetchall()
+
+    def historial_tag(self, tag, desde=None, hasta=None, limite=10000):
+        return self.conn.execute(
+            "SELECT ts, tag, puerto, rssi, lecturas FROM lecturas WHERE tag = ? AND ts >= ? AND ts < ? "
+            "ORDER BY ts LIMIT ?",
+            (tag.upper(), desde if desde is not None else 0, hasta if hasta is not None else 1e12, limite)).fetchall()
+
+    def estadisticas_puertos(self, desde=None, hasta=None):
+        """(puerto, filas, lecturas, tags distintos, primera, ultima, RSSI medio) por puerto.
+
+        Con limites en dias completos (o sin limites) se usa resumen_diario.
+        """
+        dia_desde = self._dia_completo(desde)
+        dia_hasta = self._dia_completo(hasta)
+        if dia_desde is not False and dia_hasta is not False:
+            return self.conn.execute(
+                "SELECT NULLIF(puerto, ''), SUM(filas), SUM(lecturas), COUNT(DISTINCT tag), MIN(primera), "
+                "MAX(ultima), CAST(SUM(rssi_suma) AS REAL) / NULLIF(SUM(rssi_n), 0) "
+                "FROM resumen_diario WHERE dia >= ? AND dia < ? GROUP BY puerto ORDER BY puerto",
+                (dia_desde or "", dia_hasta or "9999")).fetchall()
+        return self.conn.execute(
+            "SELECT puerto, COUNT(*), SUM(lecturas), COUNT(DISTINCT tag), MIN(ts), MAX(ts), AVG(rssi) "
+            "FROM lecturas WHERE ts >= ? AND ts < ? GROUP BY puerto ORDER BY puerto",
+            (desde if desde is not None else 0, hasta if hasta is not None else 1e12)).fetchall()
+
+    @staticmethod
+    def _dia_completo(ts):
+        """'YYYY-mm-dd' si ts es medianoche local, None si no hay limite, False en otro caso."""
+        if ts is None:
+            return None
+        d = datetime.fromtimestamp(ts)
+        if d.hour or d.minute or d.second or d.microsecond:
+            return False
+        return d.strftime("%Y-%m-%d")
+
+
+def _hora(ts):
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def _imprimir_filas(filas):
+    for ts, tag, puerto, rssi, lecturas in filas:
+        print("%s  %s  %s  %s dBm  x%d" % (_hora(ts), tag, puerto or "-", "-" if rssi is None else rssi, lecturas))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Historico local de lecturas RFID")
+    parser.add_argument("--db", default=ARCHIVO_DB)
+    sub = parser.add_subparsers(dest="accion", required=True)
+
+    p = sub.add_parser("ingerir", help="cargar CSV de captura")
+    p.add_argument("archivos", nargs="+")
+
+    p = sub.add_parser("rango", help="lecturas entre dos fechas")
+    p.add_argument("desde")
+    p.add_argument("hasta")
+    p.add_argument("--puerto")
+    p.add_argument("--limite", type=int, default=10000)
+
+    p = sub.add_parser("tag", help="historial de un tag")
+    p.add_argument("tag")
+    p.add_argument("--desde")
+    p.add_argument("--hasta")
+    p.add_argument("--limite", type=int, default=10000)
+
+    p = sub.add_parser("puertos", help="estadisticas por puerto")
+    p.add_argument("--desde")
+    p.add_argument("--hasta")
+
+    args = parser.parse_args(argv)
+    historico = HistoricoRFID(args.db)
+    t0 = time.perf_counter()
+    try:
+        if args.accion == "ingerir":
+            for ruta in args.archivos:
+                if not os.path.exists(ruta):
+                    print("Error: No se encuentra " + ruta)
+                    continue
+                print("%s: %d filas nuevas" % (ruta, historico.ingerir_csv(ruta)))
+        elif args.accion == "rango":
+            _imprimir_filas(historico.rango(_parsear_fecha(args.desde), _parsear_fecha(args.hasta),
+                                            args.puerto, args.limite))
+        elif args.accion == "tag":
+            _imprimir_filas(historico.historial_tag(args.tag, _parsear_fecha(args.desde),
+                                                    _parsear_fecha(args.hasta), args.limite))
+        elif args.accion == "puertos":
+            for puerto, filas, lecturas, tags, primera, ultima, rssi in historico.estadisticas_puertos(
+                    _parsear_fecha(args.desde), _parsear_fecha(args.hasta)):
+                print("%s: %d filas, %d lecturas, %d tags, %s -> %s, RSSI medio %s" % (
+                    puerto or "-", filas, lecturas, tags, _hora(primera), _hora(ultima),
+                    "-" if rssi is None else "%.1f" % rssi))
+    finally:
+        historico.cerrar()
+    print("(%.1f ms)" % ((time.perf_counter() - t0) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Lector YRM1001 simulado con la interfaz de serial.Serial (write/read/in_waiting/close).
+
+Responde a los comandos de comandos.py con tramas de respuesta y, durante el
+inventario multiple, genera notificaciones de tags a partir de un modelo
+simple de rondas Gen2:
+  - un tag responde si potencia - perdida del tag - ruido del canal > UMBRAL_DBM
+  - cada ronda tiene 2^Q slots; solo los slots con un unico tag son lecturas
+    (Q bajo = colisiones, Q alto = rondas largas)
+  - en sesion 0 los tags responden en cada ronda; en sesion >= 1 un tag
+    leido queda inventariado PERSISTENCIA_S segundos (menos duplicados)
+  - una ronda sin lecturas responde con la trama de error 0x15 (sin tag),
+    como el lector real durante el inventario multiple
+
+No pretende reproducir la fisica del lector, solo dar una respuesta a los
+parametros RF con compromisos reales para probar calibracion.py y los hilos
+lectores sin hardware.
+"""
+import random
+import threading
+import time
+
+from comandos import (CMD_CANAL, CMD_DETENER_MULTIPLE, CMD_ERROR, CMD_INVENTARIO_MULTIPLE, CMD_POTENCIA,
+                      CMD_QUERY, CMD_REGION, ERROR_SIN_TAG, TIPO_NOTIFICACION, TIPO_RESPUESTA)
+
+UMBRAL_DBM = 8.0
+POTENCIA_MIN = 18.0
+POTENCIA_MAX = 26.0
+SLOT_S = 0.0004
+RONDA_BASE_S = 0.002
+PERSISTENCIA_S = 0.5
+MAX_RONDAS_POR_LLAMADA = 500
+
+
+def _trama(tipo, cmd, params=b""):
+    cuerpo = bytes([tipo, cmd, (len(params) >> 8) & 0xFF, len(params) & 0xFF]) + bytes(params)
+    return b"\xBB" + cuerpo + bytes([sum(cuerpo) & 0xFF]) + b"\x7E"
+
+
+class LectorSimulado:
+    def __init__(self, n_tags=40, semilla=0, canales_ruidosos=None, timeout=0.05):
+        self._rng = random.Random(semilla)
+        # (epc, perdida dB): la perdida fija que tags quedan fuera de alcance a baja potencia
+        self.tags = [(self._rng.getrandbits(96).to_bytes(12, "big"), self._rng.uniform(4, 20))
+                     for _ in range(n_tags)]
+        self.canales_ruidosos = canales_ruidosos if canales_ruidosos is not None else \
+            {c: self._rng.uniform(0, 6) for c in range(0, 0x32, 3)}
+        self.timeout = timeout
+        self.region = None
+        self.canal = None
+        self.potencia = 26.0
+        self.q = 4
+        self.sesion = 0
+        self.leyendo = False
+        self.is_open = True
+        self._salida = bytearray()
+        self._lock = threading.Lock()
+        self._t_ultimo = time.monotonic()
+        self._inventariado = {}
+
+    # ----------------------------------------
+    # INTERFAZ serial.Serial
+    # ----------------------------------------
+    def write(self, datos):
+        datos = bytes(datos)
+        if len(datos) < 7 or datos[0] != 0xBB:
+            return len(datos)
+        cmd = datos[2]
+        params = datos[5:-2]
+        with self._lock:
+            self._generar()
+            respuesta = self._comando(cmd, params)
+            if respuesta is not None:
+                self._salida += respuesta
+        return len(datos)
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._generar()
+            return len(self._salida)
+
+    def read(self, n=1):
+        limite = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                self._generar()
+                if self._salida:
+                    datos = bytes(self._salida[:n])
+                    del self._salida[:n]
+                    return datos
+            if time.monotonic() >= limite:
+                return b""
+            time.sleep(0.002)
+
+    def close(self):
+        self.is_open = False
+
+    # ----------------------------------------
+    # MODELO
+    # ----------------------------------------
+    def _comando(self, cmd, params):
+        if cmd == CMD_REGION:
+            self.region = params[0]
+        elif cmd == CMD_CANAL:
+            self.canal = params[0]
+        elif cmd == CMD_POTENCIA:
+            dbm = ((params[0] << 8) | params[1]) / 100.0
+            if not POTENCIA_MIN <= dbm <= POTENCIA_MAX:
+                return _trama(TIPO_RESPUESTA, CMD_ERROR, [0x17])
+            self.potencia = dbm
+        elif cmd == CMD_QUERY:
+            valor = (params[0] << 8) | params[1]
+            self.q = (valor >> 3) & 0x0F
+            self.sesion = (valor >> 8) & 0x03
+        elif cmd == CMD_INVENTARIO_MULTIPLE:
+            self.leyendo = True
+            self._t_ultimo = time.monotonic()
+            return None
+        elif cmd == CMD_DETENER_MULTIPLE:
+            self.leyendo = False
+        else:
+            return _trama(TIPO_RESPUESTA, CMD_ERROR, [0x17])
+        return _trama(TIPO_RESPUESTA, cmd, [0x00])
+
+    def _generar(self):
+        ahora = time.monotonic()
+        if not self.leyendo:
+            self._t_ultimo = ahora
+            return
+        slots = 1 << self.q
+        duracion_ronda = RONDA_BASE_S + slots * SLOT_S
+        rondas = min(int((ahora - self._t_ultimo) / duracion_ronda), MAX_RONDAS_POR_LLAMADA)
+        if rondas <= 0:
+            return
+        self._t_ultimo += rondas * duracion_ronda
+        ruido = self.canales_ruidosos.get(self.canal, 0.0)
+        visibles = [(epc, perdida) for epc, perdida in self.tags if self.potencia - perdida - ruido > UMBRAL_DBM]
+        rng = self._rng
+        for r in range(rondas):
+            t = self._t_ultimo - (rondas - r) * duracion_ronda
+            participantes = visibles
+            if self.sesion:
+                participantes = [v for v in visibles if self._inventariado.get(v[0], 0.0) <= t]
+            ocupacion = {}
+            for tag in participantes:
+                ocupacion.setdefault(rng.randrange(slots), []).append(tag)
+            leidos = 0
+            for en_slot in ocupacion.values():
+                if len(en_slot) != 1:
+                    continue
+                epc, perdida = en_slot[0]
+                margen = self.potencia - perdida - ruido - UMBRAL_DBM
+                if rng.random() > min(1.0, margen / 6.0):
+                    continue
+                if self.sesion:
+                    self._inventariado[epc] = t + PERSISTENCIA_S
+                rssi = int(-30 - perdida * 2 + (self.potencia - POTENCIA_MAX)) & 0xFF
+                self._salida += _trama(TIPO_NOTIFICACION, 0x22, bytes([rssi, 0x30, 0x00]) + epc + b"\x00\x00")
+                leidos += 1
+            if not leidos:
+                self._salida += _trama(TIPO_RESPUESTA, CMD_ERROR, [ERROR_SIN_TAG])
@@ -1,61 +1,125 @@
 # -*- coding: utf-8 -*-
 import serial
-import serial.tools.list_ports
 import time
 import threading
-import os
-import csv
+import sys
 from datetime import datetime
 
-# --- CONFIGURACIÓN DE PROTOCOLO HARDWARE ---
-CMD_POTENCIA_26DBM = bytes.fromhex("BB 00 B6 00 02 0A 28 EA 7E") 
-CMD_LECTURA = bytes.fromhex("BB 00 27 00 03 22 FF FF 4A 7E")
-CMD_REGION_US = bytes.fromhex("BB 00 07 00 01 02 0A 7E")
-CMD_915_MHZ = bytes.fromhex("BB 00 AB 00 01 1A C6 7E")
+from comandos import CanalComandos, REGION_US, CANAL_915_MHZ, TIPO_RESPUESTA, cargar_perfiles, parametros_inicio
+from metricas import REGISTRO
+from supervisor import SupervisorPuertos, listar_puertos
+from sumideros import Distribuidor, SumideroCSV, SumideroConsola, SumideroPostgres, a_rfid_raw_reads
+from proceso_lector import GrupoProcesosLector
+
+# --- EXPORTACION DE METRICAS ---
+METRICAS_PUERTO_HTTP = 9108
+METRICAS_ARCHIVO = "metricas_lectura.json"
+
+COLUMNAS = ["Fecha", "Hora", "Tag_ID", "Lecturas"]
+
+class TagEscena:
+    """Registro por tag del lote abierto (sin __dict__ para abaratar la alta por trama)."""
+    __slots__ = ("ts_inicial", "conteo")
+
+    def __init__(self, ts_inicial):
+        self.ts_inicial = ts_inicial
+        self.conteo = 1
+
+
+class Carril:
+    """Estado de lote de un carril (un puerto o un grupo de puertos): escena y temporizador de silencio."""
+    __slots__ = ("nombre", "escena", "ultimo_evento", "m_lotes", "m_emision")
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.escena = {}
+        self.ultimo_evento = time.time()
+        self.m_lotes = REGISTRO.contador("sigma_lotes_carril_total", "Lotes cerrados por carril", carril=nombre)
+        self.m_emision = REGISTRO.histograma("sigma_lote_emision_segundos",
+                                             "Desde la ultima lectura del carril hasta la emision del lote",
+                                             buckets=(1, 1.1, 1.2, 1.25, 1.3, 1.4, 1.6, 2, 3, 5), carril=nombre)
+
+
+def epc_hex(tid):
+    """EPC de 96 bits (int) a los 24 caracteres hex usados en CSV y consola."""
+    return format(tid, "024X")
+
 
 class RegistradorSigma:
     def __init__(self):
         self.archivo_log = "reporte_limpio.csv"
-        self.tags_en_escena = {}  
+        self.carriles = {}  # nombre de carril -> Carril
         self.bloqueo_temporal = {} 
         self.candado = threading.Lock()
         
         # --- PARÁMETROS DE OPERACIÓN ---
-        self.umbral_latencia_lote = 1.2   # Ventana de tiempo para cierre de secuencia
+        self.umbral_latencia_lote = 1.2   # Ventana de tiempo para cierre de secuencia (por carril)
         self.tiempo_bloqueo = 600        # Intervalo de exclusión (segundos)
         self.min_lecturas_validacion = 1 
-        self.ultimo_evento_detectado = time.time()
+        self.intervalo_revision = 0.05   # Resolucion del cierre de lotes
+        # Puerto -> carril; los puertos sin grupo forman su propio carril
+        self.grupos_carril = {}
         
         self._running = False
         self._serials = []
+        self.canales = {}  # puerto -> CanalComandos (reconfiguracion en caliente)
+        self.supervisor = None
+
+        # --- CONFIGURACIÓN RF DE ARRANQUE ---
+        self.region = REGION_US
+        self.canal_rf = CANAL_915_MHZ
+        self.potencia_dbm = 26
+        # Perfil calibrado por puerto (calibracion.py); los puertos sin perfil usan los valores de arriba
+        self.perfiles_rf = cargar_perfiles()
         self.escribir_csv = True
         self.imprimir_eventos = True
 
-        if not os.path.exists(self.archivo_log):
-            self._inicializar_archivo()
+        # Modo proceso-por-lector: cada puerto en su propio proceso, tags por memoria compartida
+        self.modo_procesos = False
+        self.procesos = None
+        self._m_tramas_proceso = {}
+
+        self._m_lotes = REGISTRO.contador("sigma_lotes_total", "Lotes cerrados por silencio")
+        self._m_registros = REGISTRO.contador("sigma_tags_registrados_total", "Tags persistidos")
+        REGISTRO.gauge("sigma_tags_en_escena", "Tags en los lotes abiertos",
+                       funcion=lambda: sum(len(c.escena) for c in list(self.carriles.values())))
+        REGISTRO.gauge("sigma_tags_bloqueados", "Tags en intervalo de exclusion", funcion=lambda: len(self.bloqueo_temporal))
 
-    def _inicializar_archivo(self):
-        with open(self.archivo_log, "a", newline='') as f:
-            csv.writer(f).writerow(["Fecha", "Hora", "Tag_ID", "Lecturas"])
+        # Sumideros adicionales (Postgres, SQLite...) ademas del CSV y la consola
+        self.sumideros_extra = []
+        self.distribuidor = None
+
+    def _crear_distribuidor(self):
+        sumideros = []
+        if self.escribir_csv:
+            sumideros.append(SumideroCSV(self.archivo_log, COLUMNAS))
+        if self.imprimir_eventos:
+            sumideros.append(SumideroConsola(lambda r: f"ID: {r['Tag_ID']} | REGISTRADO | {r['Hora']}"))
+        return Distribuidor(sumideros + list(self.sumideros_extra))
 
     def start(self):
-        puertos = [p.device for p in serial.tools.list_ports.comports() if 'ttyUSB' in p.device]
-        if not puertos:
-            if self.imprimir_eventos:
-                print("------------------------------------------")
-                print("SIGMA UHF - Error: No hay sensores")
-                print("------------------------------------------")
-            return False
+        puertos = listar_puertos()
+        if not puertos and self.imprimir_eventos:
+            print("------------------------------------------")
+            print("SIGMA UHF - Sin sensores, esperando conexion")
+            print("------------------------------------------")
         
         self._running = True
         num_sensores = len(puertos)
+        self.distribuidor = self._crear_distribuidor()
 
         # Inicialización de hilos de control y monitoreo
         threading.Thread(target=self._procesamiento_secuencial_lotes, daemon=True).start()
         
-        for p in puertos:
-            t = threading.Thread(target=self._gestion_interfaz_serial, args=(p,), daemon=True)
-            t.start()
+        # El supervisor lanza un hilo por puerto y lo relanza si el lector se desconecta
+        objetivo = self._gestion_interfaz_serial
+        if self.modo_procesos:
+            self.procesos = GrupoProcesosLector(self.region, self.canal_rf, self.potencia_dbm, perfiles=self.perfiles_rf)
+            self.procesos.activo = True
+            objetivo = self.procesos.ejecutar
+            threading.Thread(target=self.procesos.drenar, args=(self._entregar_lote,), daemon=True).start()
+        self.supervisor = SupervisorPuertos(objetivo, nombre="sigma", imprimir_eventos=self.imprimir_eventos)
+        self.supervisor.start()
         
         if self.imprimir_eventos:
             print("------------------------------------------")
@@ -66,21 +130,28 @@ class RegistradorSigma:
         return True
 
     def _gestion_interfaz_serial(self, puerto):
-        """Gestión de bajo nivel para la captura de tramas UHF."""
+        """Gestión de bajo nivel para la captura de tramas UHF.
+
+        Los errores de E/S se propagan al supervisor, que relanza el hilo.
+        """
+        ser = serial.Serial(puerto, 115200, timeout=0.01)
+        self._serials.append(ser)
+        canal = CanalComandos(ser, puerto)
+        self.canales[puerto] = canal
         try:
-            ser = serial.Serial(puerto, 115200, timeout=0.01)
-            self._serials.append(ser)
-            
-            # Inicialización de hardware
-            ser.write(CMD_REGION_US); time.sleep(0.1)
-            ser.write(CMD_915_MHZ); time.sleep(0.1)
-            ser.write(CMD_POTENCIA_26DBM); time.sleep(0.1)
-            ser.write(CMD_LECTURA)
+            # Inicialización de hardware: corre aparte porque las respuestas llegan por este hilo
+            rf = parametros_inicio(self.perfiles_rf, puerto, self.region, self.canal_rf, self.potencia_dbm)
+            threading.Thread(target=canal.inicializar, kwargs=rf, daemon=True).start()
+
+            m_tramas = REGISTRO.contador("sigma_tramas_total", "Tramas recibidas", puerto=puerto)
+            m_bytes = REGISTRO.contador("sigma_bytes_total", "Bytes leidos del puerto", puerto=puerto)
 
             buffer_circular = bytearray()
             while self._running:
                 if ser.in_waiting:
-                    buffer_circular.extend(ser.read(ser.in_waiting))
+                    datos = ser.read(ser.in_waiting)
+                    m_bytes.inc(len(datos))
+                    buffer_circular.extend(datos)
                     while True:
                         inicio = buffer_circular.find(b'\xBB')
                         if inicio < 0:
@@ -95,82 +166,135 @@ class RegistradorSigma:
                         
                         trama = bytes(buffer_circular[:fin + 1])
                         del buffer_circular[:fin + 1]
-                        self._analisis_discriminatorio_tag(trama)
+                        m_tramas.inc()
+                        if trama[1] == TIPO_RESPUESTA:
+                            canal.procesar(trama)
+                        else:
+                            self._analisis_discriminatorio_tag(trama, puerto)
                 else:
                     time.sleep(0.001)
-        except Exception:
-            pass
+        finally:
+            if self.canales.get(puerto) is canal:
+                del self.canales[puerto]
+            if ser in self._serials:
+                self._serials.remove(ser)
+            try:
+                ser.close()
+            except Exception:
+                pass
 
-    def _analisis_discriminatorio_tag(self, trama):
+    def _analisis_discriminatorio_tag(self, trama, puerto=None):
         """Extrae el identificador y registra el timestamp de detección inicial."""
         if len(trama) >= 19 and trama[1] == 0x02:
             segmento = trama[2:-1] if trama[-1] == 0x7E else trama[2:]
-            tag_id = segmento[6:18].hex().upper()
-            ahora = time.time()
+            # El EPC viaja como int hasta la salida (ver epc_hex)
+            self._registrar_tag(int.from_bytes(segmento[6:18], "big"), time.time(), puerto)
+
+    def _carril(self, puerto):
+        """Carril del puerto, creado al primer uso. Llamar con el candado tomado."""
+        nombre = self.grupos_carril.get(puerto, puerto)
+        carril = self.carriles.get(nombre)
+        if carril is None:
+            carril = self.carriles[nombre] = Carril(nombre)
+        return carril
+
+    def _registrar_tag(self, tag_id, ahora, puerto=None):
+        with self.candado:
+            carril = self._carril(puerto)
+            carril.ultimo_evento = ahora
+            if tag_id in self.bloqueo_temporal:
+                return
             
-            with self.candado:
-                self.ultimo_evento_detectado = ahora
-                if tag_id in self.bloqueo_temporal:
-                    return
-                
-                if tag_id not in self.tags_en_escena:
-                    # Registro de telemetría inicial para ordenamiento cronológico
-                    self.tags_en_escena[tag_id] = {
-                        'ts_inicial': ahora,
-                        'conteo': 1
-                    }
-                else:
-                    self.tags_en_escena[tag_id]['conteo'] += 1
+            registro = carril.escena.get(tag_id)
+            if registro is None:
+                # Registro de telemetría inicial para ordenamiento cronológico
+                carril.escena[tag_id] = TagEscena(ahora)
+            else:
+                registro.conteo += 1
+
+    # ----------------------------------------
+    # MODO PROCESO POR LECTOR
+    # ----------------------------------------
+    def _entregar_lote(self, puerto, lote):
+        """Consumidor del modo proceso: notificaciones ya decodificadas por el proceso lector."""
+        m = self._m_tramas_proceso.get(puerto)
+        if m is None:
+            m = self._m_tramas_proceso[puerto] = REGISTRO.contador("sigma_tramas_total", "Tramas recibidas", puerto=puerto)
+        m.inc(len(lote))
+        for ts, epc, _rssi in lote:
+            self._registrar_tag(int.from_bytes(epc, "big"), ts, puerto)
 
     def _procesamiento_secuencial_lotes(self):
-        """Aplica lógica de ordenamiento tras detectar fin de ráfaga de datos."""
+        """Aplica lógica de ordenamiento tras detectar fin de ráfaga de datos, carril por carril."""
         while self._running:
-            time.sleep(0.2)
+            time.sleep(self.intervalo_revision)
             ahora = time.time()
             
             with self.candado:
-                # Se activa el procesamiento si se supera el umbral de silencio
-                if self.tags_en_escena and (ahora - self.ultimo_evento_detectado > self.umbral_latencia_lote):
-                    
-                    # Generación de matriz para ordenamiento
-                    lote_ordenado = list(self.tags_en_escena.items())
-                    
-                    # Algoritmo de ordenamiento basado en detección de primer flanco
-                    lote_ordenado.sort(key=lambda x: x[1]['ts_inicial'])
-                    
-                    for tid, data in lote_ordenado:
-                        self._persistencia_datos(tid, data)
-                        self.bloqueo_temporal[tid] = ahora + self.tiempo_bloqueo
-                    
-                    self.tags_en_escena.clear()
+                for carril in list(self.carriles.values()):
+                    # Cada carril cierra con su propio umbral de silencio
+                    if carril.escena and (ahora - carril.ultimo_evento > self.umbral_latencia_lote):
+                        self._cerrar_lote(carril, ahora)
+
+    def _cerrar_lote(self, carril, ahora):
+        # Algoritmo de ordenamiento basado en detección de primer flanco
+        lote_ordenado = sorted(carril.escena.items(), key=lambda x: x[1].ts_inicial)
+        carril.escena.clear()
+
+        emitidos = 0
+        for tid, data in lote_ordenado:
+            # Un tag visto por dos carriles a la vez se emite solo con el primero que cierra
+            if tid in self.bloqueo_temporal:
+                continue
+            self._persistencia_datos(tid, data)
+            self.bloqueo_temporal[tid] = ahora + self.tiempo_bloqueo
+            emitidos += 1
+
+        carril.m_lotes.inc()
+        carril.m_emision.observar(ahora - carril.ultimo_evento)
+        self._m_lotes.inc()
+        self._m_registros.inc(emitidos)
 
     def _persistencia_datos(self, tid, data):
         """Escritura de registros validados en almacenamiento persistente."""
-        ts = datetime.fromtimestamp(data['ts_inicial'])
-        if self.escribir_csv:
-            with open(self.archivo_log, "a", newline='') as f:
-                csv.writer(f).writerow([
-                    ts.strftime('%Y-%m-%d'), 
-                    ts.strftime('%H:%M:%S.%f')[:-3], 
-                    tid, 
-                    data['conteo']
-                ])
-        
-        if self.imprimir_eventos:
-            print(f"ID: {tid} | REGISTRADO | {ts.strftime('%H:%M:%S.%f')[:-3]}")
+        ts = datetime.fromtimestamp(data.ts_inicial)
+        self.distribuidor.publicar({
+            "Fecha": ts.strftime('%Y-%m-%d'),
+            "Hora": ts.strftime('%H:%M:%S.%f')[:-3],
+            "Tag_ID": epc_hex(tid),
+            "Lecturas": data.conteo,
+        })
 
     def stop(self):
         self._running = False
-        for s in self._serials:
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        if self.procesos is not None:
+            self.procesos.activo = False
+        for s in list(self._serials):
             try:
                 s.close()
             except:
                 pass
+        if self.distribuidor is not None:
+            self.distribuidor.cerrar()
 
 if __name__ == "__main__":
     app = RegistradorSigma()
     app.imprimir_eventos = True
     app.escribir_csv = True
+    app.modo_procesos = "--procesos" in sys.argv
+    # --carril PUERTO=GRUPO (repetible): agrupa puertos de una misma puerta en un carril
+    for i, arg in enumerate(sys.argv[:-1]):
+        if arg == "--carril":
+            puerto, _, grupo = sys.argv[i + 1].partition("=")
+            app.grupos_carril[puerto] = grupo or puerto
+    if "--postgres" in sys.argv:
+        # Reemplaza el camino separado de rfiduhf para poblar rfid_raw_reads
+        app.sumideros_extra.append(SumideroPostgres("rfid_raw_reads", ["fecha", "epc_hex", "tag_id"], a_rfid_raw_reads))
+
+    REGISTRO.iniciar_http(METRICAS_PUERTO_HTTP)
+    REGISTRO.iniciar_instantaneas(METRICAS_ARCHIVO)
 
     if app.start():
         try:
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de metricas en proceso para lectores RFID y bascula.
+
+Contadores, gauges e histogramas de latencia con costo minimo en las rutas
+calientes (un lock corto por operacion). Se exponen por HTTP en /metrics
+(formato texto Prometheus, /metrics.json en JSON) y en un archivo JSON que
+se reescribe periodicamente.
+
+Cada proceso tiene su propio REGISTRO; GetPeso corre en un mp.Process y
+publica su instantanea en un archivo/puerto propio.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites superiores (segundos) por defecto para histogramas de latencia
+BUCKETS_LATENCIA = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _clave(nombre, etiquetas):
+    return (nombre, tuple(sorted(etiquetas.items())))
+
+
+def _fmt_etiquetas(etiquetas, extra=None):
+    pares = list(etiquetas)
+    if extra:
+        pares.append(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, v) for k, v in pares) + "}"
+
+
+class Contador:
+    """Valor monotono creciente."""
+    __slots__ = ("nombre", "ayuda", "etiquetas", "_valor", "_lock")
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda="", etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valor = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self._valor += n
+
+    @property
+    def valor(self):
+        return self._valor
+
+    def exportar(self):
+        return self._valor
+
+
+class Gauge:
+    """Valor instantaneo. Si se pasa `funcion`, se evalua solo al exportar."""
+    __slots__ = ("nombre", "ayuda", "etiquetas", "_valor", "_lock", "funcion")
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda="", etiquetas=(), funcion=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valor = 0.0
+        self._lock = threading.Lock()
+        self.funcion = funcion
+
+    def set(self, valor):
+        self._valor = valor
+
+    def inc(self, n=1):
+        with self._lock:
+            self._valor += n
+
+    def dec(self, n=1):
+        with self._lock:
+            self._valor -= n
+
+    @property
+    def valor(self):
+        if self.funcion is not None:
+            try:
+                return self.funcion()
+            except Exception:
+                return float("nan")
+        return self._valor
+
+    def exportar(self):
+        return self.valor
+
+
+class _Cronometro:
+    __slots__ = ("_hist", "_t0")
+
+    def __init__(self, hist):
+        self._hist = hist
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hist.observar(time.perf_counter() - self._t0)
+        return False
+
+
+class Histograma:
+    """Histograma de buckets fijos (acumulativos al exportar)."""
+    __slots__ = ("nombre", "ayuda", "etiquetas", "buckets", "_conteos",
+                 "_suma", "_n", "_max", "_lock")
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda="", etiquetas=(), buckets=BUCKETS_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = tuple(buckets)
+        self._conteos = [0] * (len(self.buckets) + 1)
+        self._suma = 0.0
+        self._n = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            self._conteos[i] += 1
+            self._suma += valor
+            self._n += 1
+            if valor > self._max:
+                self._max = valor
+
+    def tiempo(self):
+        """Context manager que observa la duracion del bloque."""
+        return _Cronometro(self)
+
+    def percentil(self, p):
+        """Estimacion por limite superior del bucket que contiene el percentil p (0-100)."""
+        with self._lock:
+            conteos = list(self._conteos)
+            n = self._n
+        if n == 0:
+            return 0.0
+        objetivo = n * p / 100.0
+        acum = 0
+        for i, c in enumerate(conteos):
+            acum += c
+            if acum >= objetivo:
+                return self.buckets[i] if i < len(self.buckets) else self._max
+        return self._max
+
+    def exportar(self):
+        with self._lock:
+            conteos = list(self._conteos)
+            suma, n, maximo = self._suma, self._n, self._max
+        acum = 0
+        buckets = {}
+        for limite, c in zip(self.buckets, conteos):
+            acum += c
+            buckets[str(limite)] = acum
+        buckets["+Inf"] = n
+        return {
+            "n": n,
+            "suma": suma,
+            "media": (suma / n) if n else 0.0,
+            "max": maximo,
+            "p50": self.percentil(50),
+            "p99": self.percentil(99),
+            "buckets": buckets,
+        }
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+        self._servidor = None
+        self._hilo_instantaneas = None
+        self._activo = False
+        self.inicio = time.time()
+
+    # ----------------------------------------
+    # ALTA DE METRICAS (get-or-create)
+    # ----------------------------------------
+    def _obtener(self, cls, nombre, ayuda, etiquetas, **kw):
+        clave = _clave(nombre, etiquetas)
+        m = self._metricas.get(clave)
+        if m is None:
+            with self._lock:
+                m = self._metricas.get(clave)
+                if m is None:
+                    m = cls(nombre, ayuda, clave[1], **kw)
+                    self._metricas[clave] = m
+        return m
+
+    def contador(self, nombre, ayuda="", **etiquetas):
+        return self._obtener(Contador, nombre, ayuda, etiquetas)
+
+    def gauge(self, nombre, ayuda="", funcion=None, **etiquetas):
+        g = self._obtener(Gauge, nombre, ayuda, etiquetas)
+        if funcion is not None:
+            g.funcion = funcion
+        return g
+
+    def histograma(self, nombre, ayuda="", buckets=BUCKETS_LATENCIA, **etiquetas):
+        return self._obtener(Histograma, nombre, ayuda, etiquetas, buckets=buckets)
+
+    # ----------------------------------------
+    # EXPORTACION
+    # ----------------------------------------
+    def instantanea(self):
+        with self._lock:
+            metricas = list(self._metricas.values())
+        datos = {"ts": time.time(), "uptime_s": time.time() - self.inicio, "metricas": []}
+        for m in metricas:
+            datos["metricas"].append({
+                "nombre": m.nombre,
+                "tipo": m.tipo,
+                "etiquetas": dict(m.etiquetas),
+                "valor": m.exportar(),
+            })
+        return datos
+
+    def texto_prometheus(self):
+        with self._lock:
+            metricas = sorted(self._metricas.values(), key=lambda m: (m.nombre, m.etiquetas))
+        lineas = []
+        vistos = set()
+        for m in metricas:
+            if m.nombre not in vistos:
+                vistos.add(m.nombre)
+                if m.ayuda:
+                    lineas.append("# HELP %s %s" % (m.nombre, m.ayuda))
+                lineas.append("# TYPE %s %s" % (m.nombre, m.tipo))
+            if m.tipo == "histogram":
+                v = m.exportar()
+                for limite, acum in v["buckets"].items():
+                    lineas.append("%s_bucket%s %s" % (m.nombre, _fmt_etiquetas(m.etiquetas, ("le", limite)), acum))
+                lineas.append("%s_sum%s %s" % (m.nombre, _fmt_etiquetas(m.etiquetas), v["suma"]))
+                lineas.append("%s_count%s %s" % (m.nombre, _fmt_etiquetas(m.etiquetas), v["n"]))
+            else:
+                lineas.append("%s%s %s" % (m.nombre, _fmt_etiquetas(m.etiquetas), m.exportar()))
+        return "\n".join(lineas) + "\n"
+
+    def iniciar_http(self, puerto=9108, host="127.0.0.1"):
+        """Levanta /metrics (texto) y /metrics.json en un hilo daemon."""
+        registro = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    cuerpo = json.dumps(registro.instantanea()).encode("utf-8")
+                    tipo = "application/json"
+                elif self.path.startswith("/metrics"):
+                    cuerpo = registro.texto_prometheus().encode("utf-8")
+                    tipo = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            self._servidor = ThreadingHTTPServer((host, puerto), _Handler)
+        except OSError as e:
+            print("METRICAS: no se pudo abrir el puerto %s: %r" % (puerto, e))
+            return False
+        self._servidor.daemon_threads = True
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        return True
+
+    def iniciar_instantaneas(self, archivo, intervalo=10.0):
+        """Reescribe `archivo` cada `intervalo` s con la instantanea y tasas (por s) de contadores."""
+        self._activo = True
+
+        def _loop():
+            previo = {}
+            t_previo = time.time()
+            while self._activo:
+                time.sleep(intervalo)
+                datos = self.instantanea()
+                dt = max(datos["ts"] - t_previo, 1e-9)
+                actual = {}
+                for m in datos["metricas"]:
+                    if m["tipo"] == "counter":
+                        clave = _clave(m["nombre"], m["etiquetas"])
+                        actual[clave] = m["valor"]
+                        m["tasa"] = (m["valor"] - previo.get(clave, 0)) / dt
+                previo, t_previo = actual, datos["ts"]
+                try:
+                    tmp = archivo + ".tmp"
+                    with open(tmp, "w") as f:
+                        json.dump(datos, f)
+                    os.replace(tmp, archivo)
+                except Exception as e:
+                    print("METRICAS: error escribiendo instantanea: %r" % (e,))
+
+        self._hilo_instantaneas = threading.Thread(target=_loop, daemon=True)
+        self._hilo_instantaneas.start()
+
+    def detener(self):
+        self._activo = False
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor = None
+
+
+# Registro por defecto del proceso
+REGISTRO = Registro()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Perfilador por muestreo activable en caliente.
+
+Toma muestras periodicas de las pilas de todos los hilos del proceso
+(sys._current_frames) durante N segundos y escribe el resultado en formato
+"collapsed stack" (una linea por pila: `hilo;mod:func:linea;... conteo`),
+compatible con flamegraph.pl y speedscope.
+
+Disparadores, sin reiniciar el proceso:
+  - Senal:   kill -USR2 <pid>
+  - Archivo: touch <archivo_disparo>  (opcionalmente con los segundos dentro,
+             p.ej. `echo 60 > /home/pi/datos/perfilar`)
+
+El archivo de disparo no se borra: cada proceso que lo vigila (principal y
+GetPeso) detecta el cambio de mtime y genera su propio perfil.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+DURACION_DEFECTO = 30  # segundos
+INTERVALO_MUESTREO = 0.01  # 100 Hz
+INTERVALO_VIGILANCIA = 1.0  # segundos entre revisiones del archivo de disparo
+
+
+class Perfilador:
+    def __init__(self, nombre, directorio=".", intervalo=INTERVALO_MUESTREO):
+        self.nombre = nombre
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self._capturando = threading.Lock()
+        self._ultimo_mtime = None
+
+    # ----------------------------------------
+    # CAPTURA
+    # ----------------------------------------
+    def capturar(self, duracion=DURACION_DEFECTO):
+        """Captura en un hilo aparte; ignora la peticion si ya hay una en curso."""
+        if not self._capturando.acquire(blocking=False):
+            return False
+        t = threading.Thread(target=self._capturar, args=(duracion,), daemon=True,
+                             name="perfilador")
+        t.start()
+        return True
+
+    def _capturar(self, duracion):
+        try:
+            pilas = self.muestrear(duracion)
+            archivo = self._escribir(pilas)
+            print("PERFILADOR: %d muestras en %s" % (sum(pilas.values()), archivo))
+        except Exception as e:
+            print("PERFILADOR: error en captura: %r" % (e,))
+        finally:
+            self._capturando.release()
+
+    def muestrear(self, duracion):
+        propio = threading.get_ident()
+        nombres = {}
+        pilas = Counter()
+        fin = time.perf_counter() + duracion
+        while time.perf_counter() < fin:
+            for ident, frame in sys._current_frames().items():
+                if ident == propio:
+                    continue
+                nombre = nombres.get(ident)
+                if nombre is None:
+                    nombre = self._nombre_hilo(ident)
+                    nombres[ident] = nombre
+                pilas[self._colapsar(nombre, frame)] += 1
+            time.sleep(self.intervalo)
+        return pilas
+
+    @staticmethod
+    def _nombre_hilo(ident):
+        for t in threading.enumerate():
+            if t.ident == ident:
+                return t.name
+        return "hilo-%d" % ident
+
+    @staticmethod
+    def _colapsar(nombre, frame):
+        partes = []
+        while frame is not None:
+            code = frame.f_code
+            partes.append("%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        partes.append(nombre)
+        partes.reverse()
+        return ";".join(p.replace(" ", "_") for p in partes)
+
+    def _escribir(self, pilas):
+        marca = datetime.now().strftime("%Y%m%d_%H%M%S")
+        archivo = os.path.join(self.directorio, "perfil_%s_%d_%s.folded" % (self.nombre, os.getpid(), marca))
+        with open(archivo, "w") as f:
+            for pila, conteo in pilas.most_common():
+                f.write("%s %d\n" % (pila, conteo))
+        return archivo
+
+    # ----------------------------------------
+    # DISPARADORES
+    # ----------------------------------------
+    def instalar_senal(self, senal=signal.SIGUSR2, duracion=DURACION_DEFECTO):
+        """Debe llamarse desde el hilo principal del proceso."""
+        signal.signal(senal, lambda signum, frame: self.capturar(duracion))
+
+    def vigilar_archivo(self, archivo_disparo, duracion=DURACION_DEFECTO):
+        try:
+            self._ultimo_mtime = os.stat(archivo_disparo).st_mtime
+        except OSError:
+            self._ultimo_mtime = None
+
+        def _loop():
+            while True:
+                time.sleep(INTERVALO_VIGILANCIA)
+                try:
+                    mtime = os.stat(archivo_disparo).st_mtime
+                except OSError:
+                    continue
+                if mtime == self._ultimo_mtime:
+                    continue
+                self._ultimo_mtime = mtime
+                self.capturar(self._leer_duracion(archivo_disparo, duracion))
+
+        threading.Thread(target=_loop, daemon=True, name="perfilador-vigia").start()
+
+    @staticmethod
+    def _leer_duracion(archivo, defecto):
+        try:
+            with open(archivo) as f:
+                contenido = f.read().strip()
+            return float(contenido) if contenido else defecto
+        except (OSError, ValueError):
+            return defecto
+
+
+def instalar(nombre, directorio=".", archivo_disparo=None, duracion=DURACION_DEFECTO):
+    """Atajo: crea el perfilador e instala senal USR2 y, si se indica, el archivo de disparo."""
+    perfilador = Perfilador(nombre, directorio)
+    try:
+        perfilador.instalar_senal(duracion=duracion)
+    except ValueError:
+        # signal.signal solo es valido en el hilo principal
+        pass
+    if archivo_disparo:
+        perfilador.vigilar_archivo(archivo_disparo, duracion)
+    return perfilador
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Modo proceso-por-lector: cada puerto serie se lee y decodifica en su propio
+proceso y las notificaciones de tags llegan al agregador por un
+AnilloCompartido, sin competir por el GIL con los hilos de agregacion y
+escritura.
+"""
+import multiprocessing as mp
+import time
+
+from anillo import AnilloCompartido
+from comandos import (CanalComandos, REGION_US, CANAL_915_MHZ, TIPO_RESPUESTA, TIPO_NOTIFICACION, trama_detener,
+                      parametros_inicio)
+
+
+def extraer_tramas(buffer):
+    """Separa del bytearray las tramas completas (por longitud PL) y valida checksum.
+
+    Devuelve (notificaciones, respuestas, checksum_fallidos); lo consumido se
+    elimina del buffer. Cada notificacion es (epc_bytes, rssi_dbm).
+    """
+    notificaciones = []
+    respuestas = []
+    fallidos = 0
+    while True:
+        ini = buffer.find(b'\xBB')
+        if ini < 0:
+            buffer.clear()
+            break
+        if ini > 0:
+            del buffer[:ini]
+        if len(buffer) < 5:
+            break
+        frame_len = 7 + ((buffer[3] << 8) | buffer[4])
+        if len(buffer) < frame_len:
+            break
+        trama = bytes(buffer[:frame_len])
+        del buffer[:frame_len]
+
+        if trama[-1] != 0x7E:
+            continue
+        if sum(trama[1:-2]) & 0xFF != trama[-2]:
+            fallidos += 1
+            continue
+        if trama[1] == TIPO_NOTIFICACION and trama[2] == 0x22:
+            rssi = trama[5]
+            notificaciones.append((trama[8:20], rssi - 256 if rssi > 127 else rssi))
+        elif trama[1] == TIPO_RESPUESTA:
+            respuestas.append(trama)
+    return notificaciones, respuestas, fallidos
+
+
+def proceso_lector(puerto, anillo, parar, region=REGION_US, canal=CANAL_915_MHZ, potencia=26, query=None):
+    """Punto de entrada del proceso hijo para un puerto. Termina al activarse `parar`
+    o ante un error de E/S (el supervisor del proceso principal lo relanza)."""
+    import serial
+    import threading
+
+    ser = serial.Serial(puerto, 115200, timeout=0.05)
+    canal_cmd = CanalComandos(ser, puerto)
+    threading.Thread(target=canal_cmd.inicializar, args=(region, canal, potencia, query), daemon=True).start()
+    buffer = bytearray()
+    try:
+        while not parar.is_set():
+            chunk = ser.read(ser.in_waiting or 1)
+            if not chunk:
+                continue
+            buffer.extend(chunk)
+            ahora = time.time()
+            notificaciones, respuestas, _ = extraer_tramas(buffer)
+            for trama in respuestas:
+                canal_cmd.procesar(trama)
+            for epc, rssi in notificaciones:
+                anillo.push(ahora, epc, rssi)
+        # Sin esperar confirmacion: este mismo hilo es el que leeria la respuesta
+        canal_cmd.enviar(trama_detener(), esperar=False)
+    finally:
+        ser.close()
+
+
+class GrupoProcesosLector:
+    """Ciclo de vida de los procesos lectores y sus anillos, del lado del proceso principal.
+
+    `ejecutar(puerto)` es el objetivo para SupervisorPuertos; `drenar(entregar)`
+    es el consumidor unico que llama `entregar(puerto, lote)` por cada lote.
+    """
+
+    def __init__(self, region=REGION_US, canal=CANAL_915_MHZ, potencia=26, capacidad=8192, perfiles=None):
+        self.region = region
+        self.canal = canal
+        self.potencia = potencia
+        self.perfiles = perfiles or {}  # perfiles RF calibrados (comandos.cargar_perfiles)
+        self.capacidad = capacidad
+        self.activo = False
+        self._anillos = {}
+        # (puerto, anillo) por anillo: un puerto relanzado puede tener uno activo y otro aun drenandose
+        self._cerrando = []
+        # forkserver: los hijos nacen de un proceso sin hilos (fork desde aqui heredaria locks tomados)
+        self._ctx = mp.get_context("forkserver")
+
+    def ejecutar(self, puerto):
+        """Lanza el proceso lector del puerto y espera a que termine (el supervisor lo relanza)."""
+        anillo = AnilloCompartido(self.capacidad)
+        parar = self._ctx.Event()
+        rf = parametros_inicio(self.perfiles, puerto, self.region, self.canal, self.potencia)
+        proc = self._ctx.Process(target=proceso_lector, args=(puerto, anillo, parar, rf["region"], rf["canal"],
+                                                       rf["potencia"], rf.get("query")), daemon=True)
+        proc.start()
+        self._anillos[puerto] = anillo
+        try:
+            while self.activo and proc.is_alive():
+                proc.join(0.1)
+            parar.set()
+            proc.join(1.0)
+            if proc.is_alive():
+                proc.terminate()
+            if self.activo:
+                raise RuntimeError("proceso lector de %s termino con codigo %s" % (puerto, proc.exitcode))
+        finally:
+            # El consumidor drena lo pendiente antes de liberar el segmento
+            if self._anillos.get(puerto) is anillo:
+                del self._anillos[puerto]
+            self._cerrando.append((puerto, anillo))
+
+    def drenar(self, entregar):
+        while self.activo or self._anillos or self._cerrando:
+            vacio = True
+            for puerto, anillo in list(self._anillos.items()):
+                lote = anillo.pop_lote()
+                if lote:
+                    vacio = False
+                    entregar(puerto, lote)
+            for entrada in list(self._cerrando):
+                puerto, anillo = entrada
+                lote = anillo.pop_lote()
+                if lote:
+                    vacio = False
+                    entregar(puerto, lote)
+                else:
+                    self._cerrando.remove(entrada)
+                    anillo.cerrar()
+            if vacio:
+                time.sleep(0.002)
+
+    def descartados(self):
+        return sum(a.descartados() for a in list(self._anillos.values()))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Reproceso masivo de viajes: reasigna seriales RFID a racimitos por lote.
+
+Aplica la misma regla que RFIDUHF.procesar_viaje (tags de rfid_raw_reads en
+la ventana [fecha, fecha_final] del viaje, sin duplicados y en orden de
+primera lectura, asignados en orden a los racimitos del viaje por
+racimito_id; los racimitos sobrantes quedan con serial NULL), pero para
+muchos viajes a la vez:
+
+  - una consulta de viajes, una de racimitos y un unico barrido de
+    rfid_raw_reads ordenado por fecha (cursor de servidor), unidos por
+    merge-join contra las ventanas de los viajes
+  - las asignaciones se aplican con un solo UPDATE ... FROM (VALUES ...),
+    solo para las filas que cambian, en una transaccion
+  - --simular muestra el diff sin escribir
+  - --procesos N reparte los dias entre N procesos, cada uno con su conexion,
+    su barrido y su UPDATE (uno por dia)
+
+Los viajes sin fecha_final (viaje en curso) se omiten. A diferencia de
+procesar_viaje, las lecturas no se borran salvo con --limpiar.
+
+Uso:
+  python reproceso.py --desde 2026-10-01 --hasta 2026-10-15 --simular
+  python reproceso.py --viajes 812 813 820
+  python reproceso.py --desde 2026-10-01 --hasta 2026-10-15 --procesos 4 [--limpiar]
+"""
+import argparse
+import multiprocessing as mp
+import time
+from datetime import datetime, timedelta
+
+CONEXION = {"dbname": "estomadb", "user": "postgres", "password": "sioma"}
+FILAS_POR_LECTURA = 20000  # itersize del cursor de servidor
+
+
+def conectar(conexion=None):
+    import psycopg2
+    return psycopg2.connect(**(conexion or CONEXION))
+
+
+# ----------------------------------------
+# CONSULTAS
+# ----------------------------------------
+def cargar_viajes(cur, desde=None, hasta=None, ids=None):
+    """Viajes cerrados [(viaje_id, inicio, fin)] ordenados por inicio."""
+    if ids:
+        cur.execute("""
+            SELECT viaje_id, fecha, fecha_final FROM viajes
+            WHERE viaje_id = ANY(%s) AND fecha_final IS NOT NULL
+            ORDER BY fecha, viaje_id
+        """, (list(ids),))
+    else:
+        cur.execute("""
+            SELECT viaje_id, fecha, fecha_final FROM viajes
+            WHERE fecha >= %s AND fecha < %s AND fecha_final IS NOT NULL
+            ORDER BY fecha, viaje_id
+        """, (desde, hasta))
+    return cur.fetchall()
+
+
+def cargar_racimos(cur, viaje_ids):
+    """{viaje_id: [(racimito_id, serial_actual)]} en orden de racimito_id."""
+    racimos = {v: [] for v in viaje_ids}
+    cur.execute("""
+        SELECT viaje_id, racimito_id, serial FROM racimitos
+        WHERE viaje_id = ANY(%s)
+        ORDER BY viaje_id, racimito_id
+    """, (list(viaje_ids),))
+    for viaje_id, racimito_id, serial in cur:
+        racimos[viaje_id].append((racimito_id, serial))
+    return racimos
+
+
+def barrer_lecturas(conn, inicio, fin):
+    """Lecturas (fecha, tag_id) entre inicio y fin en orden de fecha, en streaming."""
+    cur = conn.cursor(name="reproceso_lecturas_%d" % id(conn))
+    cur.itersize = FILAS_POR_LECTURA
+    cur.execute("""
+        SELECT fecha, tag_id FROM rfid_raw_reads
+        WHERE fecha >= %s AND fecha <= %s
+        ORDER BY fecha
+    """, (inicio, fin))
+    try:
+        for fila in cur:
+            yield fila
+    finally:
+        cur.close()
+
+
+# ----------------------------------------
+# ASIGNACION
+# ----------------------------------------
+def tags_por_viaje(viajes, lecturas):
+    """
+    Merge-join de lecturas ordenadas contra ventanas de viaje ordenadas por inicio.
+
+    Devuelve ({viaje_id: [tag_id unicos en orden]}, lecturas_usadas). Una
+    lectura en ventanas solapadas (reloj movido) cuenta para todos sus viajes,
+    igual que con procesar_viaje viaje a viaje.
+    """
+    tags = {v[0]: [] for v in viajes}
+    vistos = {v[0]: set() for v in viajes}
+    activos = []
+    siguiente = 0
+    usadas = 0
+    for fecha, tag in lecturas:
+        while siguiente < len(viajes) and viajes[siguiente][1] <= fecha:
+            activos.append(viajes[siguiente])
+            siguiente += 1
+        if activos and any(v[2] < fecha for v in activos):
+            activos = [v for v in activos if v[2] >= fecha]
+        if activos:
+            usadas += 1
+        for viaje_id, _inicio, _fin in activos:
+            if tag not in vistos[viaje_id]:
+                vistos[viaje_id].add(tag)
+                tags[viaje_id].append(tag)
+    return tags, usadas
+
+
+def diferencias(racimos, tags):
+    """Cambios [(viaje_id, racimito_id, serial_actual, serial_nuevo)]."""
+    cambios = []
+    for viaje_id, lista in racimos.items():
+        orden = tags.get(viaje_id, [])
+        for i, (racimito_id, actual) in enumerate(lista):
+            nuevo = orden[i] if i < len(orden) else None
+            if nuevo != actual:
+                cambios.append((viaje_id, racimito_id, actual, nuevo))
+    return cambios
+
+
+# ----------------------------------------
+# REPROCESO
+# ----------------------------------------
+def reprocesar(viajes, simular=True, limpiar=False, conexion=None):
+    """Reprocesa `viajes` [(viaje_id, inicio, fin)] con una conexion; devuelve (cambios, resumen)."""
+    t0 = time.time()
+    conn = conectar(conexion)
+    try:
+        with conn.cursor() as cur:
+            racimos = cargar_racimos(cur, [v[0] for v in viajes])
+        inicio = min(v[1] for v in viajes)
+        fin = max(v[2] for v in viajes)
+        tags, usadas = tags_por_viaje(viajes, barrer_lecturas(conn, inicio, fin))
+        cambios = diferencias(racimos, tags)
+
+        if not simular:
+            from psycopg2.extras import execute_values
+            with conn.cursor() as cur:
+                if cambios:
+                    execute_values(cur, """
+                        UPDATE racimitos AS r SET serial = v.serial
+                        FROM (VALUES %s) AS v (racimito_id, serial)
+                        WHERE r.racimito_id = v.racimito_id
+                    """, [(c[1], c[3]) for c in cambios], template="(%s, %s::text)",
+                       page_size=len(cambios))
+                if limpiar:
+                    execute_values(cur, """
+                        DELETE FROM rfid_raw_reads AS l
+                        USING (VALUES %s) AS v (inicio, fin)
+                        WHERE l.fecha >= v.inicio AND l.fecha <= v.fin
+                    """, [(v[1], v[2]) for v in viajes], template="(%s::timestamp, %s::timestamp)",
+                       page_size=len(viajes))
+            conn.commit()
+    finally:
+        conn.close()
+
+    resumen = {
+        "viajes": len(viajes),
+        "racimos": sum(len(r) for r in racimos.values()),
+        "lecturas": usadas,
+        "cambios": len(cambios),
+        "segundos": round(time.time() - t0, 2),
+    }
+    return cambios, resumen
+
+
+def _reprocesar_dia(argumentos):
+    dia, viajes, simular, limpiar, conexion = argumentos
+    cambios, resumen = reprocesar(viajes, simular, limpiar, conexion)
+    return dia, cambios, resumen
+
+
+def agrupar_por_dia(viajes):
+    dias = {}
+    for v in viajes:
+        dias.setdefault(v[1].date(), []).append(v)
+    return dias
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reproceso masivo de asignaciones RFID por viaje")
+    seleccion = parser.add_mutually_exclusive_group(required=True)
+    seleccion.add_argument("--desde", help="YYYY-MM-DD, viajes que inician desde este dia")
+    seleccion.add_argument("--viajes", nargs="+", type=int, help="lista de viaje_id")
+    parser.add_argument("--hasta", help="YYYY-MM-DD inclusive (por defecto igual a --desde)")
+    parser.add_argument("--simular", action="store_true", help="mostrar el diff sin escribir")
+    parser.add_argument("--limpiar", action="store_true", help="borrar las lecturas de las ventanas procesadas")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos en paralelo (reparto por dia)")
+    args = parser.parse_args(argv)
+
+    desde = hasta = None
+    if args.desde:
+        desde = datetime.strptime(args.desde, "%Y-%m-%d")
+        hasta = datetime.strptime(args.hasta or args.desde, "%Y-%m-%d") + timedelta(days=1)
+
+    conn = conectar()
+    try:
+        with conn.cursor() as cur:
+            viajes = cargar_viajes(cur, desde, hasta, args.viajes)
+    finally:
+        conn.close()
+    if not viajes:
+        print("No hay viajes cerrados en la seleccion")
+        return
+
+    dias = agrupar_por_dia(viajes)
+    if args.procesos > 1 and len(dias) > 1:
+        tareas = [(dia, dias[dia], args.simular, args.limpiar, None) for dia in sorted(dias)]
+        with mp.Pool(min(args.procesos, len(tareas))) as pool:
+            resultados = sorted(pool.imap_unordered(_reprocesar_dia, tareas), key=lambda r: r[0])
+    else:
+        # Un solo proceso: un barrido y un UPDATE para todo el rango
+        rango = "%s .. %s" % (min(dias), max(dias))
+        resultados = [_reprocesar_dia((rango, viajes, args.simular, args.limpiar, None))]
+
+    total = {"viajes": 0, "racimos": 0, "lecturas": 0, "cambios": 0}
+    for dia, cambios, resumen in resultados:
+        print("== %s: %d viajes, %d racimos, %d lecturas, %d cambios (%.2f s)" % (
+            dia, resumen["viajes"], resumen["racimos"], resumen["lecturas"], resumen["cambios"], resumen["segundos"]))
+        if args.simular:
+            for viaje_id, racimito_id, actual, nuevo in cambios:
+                print("  viaje %s racimito %s: %s -> %s" % (viaje_id, racimito_id, actual, nuevo))
+        for clave in total:
+            total[clave] += resumen[clave]
+
+    print("Total: %(viajes)d viajes, %(racimos)d racimos, %(lecturas)d lecturas, %(cambios)d cambios" % total,
+          "(simulado, sin escribir)" if args.simular else "aplicados")
+
+
+if __name__ == "__main__":
+    main()
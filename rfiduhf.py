@@ -1,10 +1,23 @@
 
 # -*- coding: utf-8 -*-
 
+import os
 import serial
+import threading
 import time
+from collections import deque
+from datetime import datetime
+
 import psycopg2
 
+from metricas import REGISTRO
+from supervisor import listar_puertos, BACKOFF_MIN, BACKOFF_MAX
+from proceso_lector import extraer_tramas
+from sumideros import Distribuidor, SumideroPostgres, a_rfid_raw_reads
+
+BUFFER_BLOQUES = 4096  # Bloques leidos del puerto en espera de decodificar
+ESPERA_CIERRE_VIAJE = 3.0  # Segundos para que las lecturas del viaje terminen de escribirse antes de procesarlo
+
 class RFIDUHF:
 
     def __init__(self):
@@ -12,18 +25,79 @@ class RFIDUHF:
         self.baudrate = 115200
         self.ser = None
         self.last_viaje = None
+        self.puerto_actual = None
+        self.conectado_desde = None
+        self.reconexiones = 0
+        self._backoff = BACKOFF_MIN
+        self._proximo_intento = 0.0
+        self._m_bytes = REGISTRO.contador("rfiduhf_bytes_total", "Bytes leidos del lector")
+        REGISTRO.gauge("rfiduhf_conectado", "Lector abierto (1/0)", funcion=lambda: int(self.ser is not None))
+        REGISTRO.gauge("rfiduhf_uptime_segundos", "Tiempo desde la ultima conexion",
+                       funcion=lambda: (time.time() - self.conectado_desde) if self.ser is not None else 0.0)
+        self._m_reconexiones = REGISTRO.contador("rfiduhf_reconexiones_total", "Caidas del puerto serie")
+        self._m_lecturas = REGISTRO.contador("rfiduhf_lecturas_total", "Lecturas insertadas en rfid_raw_reads")
+        self._m_errores = REGISTRO.contador("rfiduhf_errores_total", "Errores en el loop principal")
+        self._m_tramas = REGISTRO.contador("rfiduhf_tramas_total", "Tramas de tag decodificadas")
+        self._m_fallidas = REGISTRO.contador("rfiduhf_tramas_fallidas_total", "Tramas con checksum invalido")
+        self._m_desbordes = REGISTRO.contador("rfiduhf_desbordes_total", "Bloques descartados por buffer lleno")
+
+        # Captura continua: el hilo lector solo vacia el puerto hacia este buffer; el decodificador
+        # lo consume y publica en rfid_raw_reads por lotes, sin depender del monitor de viajes
+        self._bloques = deque()
+        self._hay_bloques = threading.Condition()
+        self.capacidad_buffer = BUFFER_BLOQUES
+        REGISTRO.gauge("rfiduhf_buffer_bloques", "Bloques en espera de decodificar", funcion=lambda: len(self._bloques))
+        self.distribuidor = None
+        self._activo = False
         self.connect_reader()
 
     # ----------------------------------------
     # CONEXION LECTOR RFID
     # ----------------------------------------
     def connect_reader(self):
+        # Si el puerto configurado no existe (re-enumeracion USB) se usa el primero disponible
+        puerto = self.port
+        if not os.path.exists(puerto):
+            disponibles = listar_puertos()
+            if disponibles:
+                puerto = disponibles[0]
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=0.1)
-            print("RFIDUHF conectado al lector")
+            self.ser = serial.Serial(puerto, self.baudrate, timeout=0.1)
+            self.puerto_actual = puerto
+            self.conectado_desde = time.time()
+            self._backoff = BACKOFF_MIN
+            print("RFIDUHF conectado al lector", puerto)
         except Exception as e:
+            self.ser = None
+            self._proximo_intento = time.time() + self._backoff
+            self._backoff = min(self._backoff * 2, BACKOFF_MAX)
             print("Error conectando lector RFID:", e)
 
+    def desconectar_reader(self):
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+        self.ser = None
+        self.reconexiones += 1
+        self._m_reconexiones.inc()
+        self._proximo_intento = time.time() + self._backoff
+        print("RFIDUHF lector desconectado, reintentando")
+
+    def lector_disponible(self):
+        """Reabre el puerto con backoff exponencial si se cayo."""
+        if self.ser is None and time.time() >= self._proximo_intento:
+            self.connect_reader()
+        return self.ser is not None
+
+    def estado_lector(self):
+        return {
+            "puerto": self.puerto_actual,
+            "conectado": self.ser is not None,
+            "uptime_s": round(time.time() - self.conectado_desde, 1) if self.ser is not None else 0.0,
+            "reconexiones": self.reconexiones,
+        }
+
     # ----------------------------------------
     # CONEXION BASE DE DATOS
     # ----------------------------------------
@@ -38,44 +112,70 @@ class RFIDUHF:
     # CAPTURA CONTINUA RFID
     # ----------------------------------------
     def capturar(self):
+        """Lee lo disponible en el puerto y lo deja en el buffer con su hora de lectura."""
+
+        if not self.lector_disponible():
+            time.sleep(0.05)
+            return
 
         try:
             data = self.ser.read(self.ser.in_waiting or 1)
-
-            if not data:
-                return
-
-            epc = data.hex().upper()
-
-            # usar últimos 4 caracteres como ID
-            tag = epc[-4:]
-
-            with self.db() as conn:
-                with conn.cursor() as cur:
-
-                    cur.execute("""
-                        INSERT INTO rfid_raw_reads
-                        (fecha, epc_hex, tag_id)
-                        VALUES (NOW(), %s, %s)
-                    """, (epc, tag))
-
-                conn.commit()
-
-        except:
-            pass
+        except (serial.SerialException, OSError):
+            self.desconectar_reader()
+            return
+
+        if not data:
+            return
+
+        self._m_bytes.inc(len(data))
+        with self._hay_bloques:
+            if len(self._bloques) >= self.capacidad_buffer:
+                self._bloques.popleft()
+                self._m_desbordes.inc()
+            self._bloques.append((time.time(), data))
+            self._hay_bloques.notify()
+
+    def _hilo_captura(self):
+        while self._activo:
+            self.capturar()
+
+    def _hilo_decodificador(self):
+        buffer = bytearray()
+        while self._activo or self._bloques:
+            with self._hay_bloques:
+                while not self._bloques and self._activo:
+                    self._hay_bloques.wait(0.5)
+                bloques = list(self._bloques)
+                self._bloques.clear()
+
+            for ts, data in bloques:
+                buffer.extend(data)
+                notificaciones, _, fallidos = extraer_tramas(buffer)
+                if fallidos:
+                    self._m_fallidas.inc(fallidos)
+                if not notificaciones:
+                    continue
+                self._m_tramas.inc(len(notificaciones))
+                hora = datetime.fromtimestamp(ts)
+                fecha = hora.strftime('%Y-%m-%d')
+                hora_ms = hora.strftime('%H:%M:%S.%f')[:-3]
+                for epc, _rssi in notificaciones:
+                    self.distribuidor.publicar({"Fecha": fecha, "Hora_MS": hora_ms, "Tag_ID": epc.hex().upper()})
+                self._m_lecturas.inc(len(notificaciones))
 
     # ----------------------------------------
     # OBTENER VIAJE ACTUAL
     # ----------------------------------------
     def get_viaje(self):
 
-        with self.db() as conn:
-            with conn.cursor() as cur:
+        with REGISTRO.histograma("rfiduhf_db_segundos", "Latencia de llamadas a la BD", op="get_viaje").tiempo():
+            with self.db() as conn:
+                with conn.cursor() as cur:
 
-                cur.execute("SELECT max(viaje_id) FROM viajes")
-                row = cur.fetchone()
+                    cur.execute("SELECT max(viaje_id) FROM viajes")
+                    row = cur.fetchone()
 
-                return row[0]
+                    return row[0]
 
     # ----------------------------------------
     # PROCESAR VIAJE FINALIZADO
@@ -156,26 +256,49 @@ class RFIDUHF:
     # ----------------------------------------
     # LOOP PRINCIPAL
     # ----------------------------------------
+    def iniciar_captura(self):
+        self._activo = True
+        self.distribuidor = Distribuidor([
+            SumideroPostgres("rfid_raw_reads", ["fecha", "epc_hex", "tag_id"], a_rfid_raw_reads)])
+        threading.Thread(target=self._hilo_captura, daemon=True, name="rfiduhf-captura").start()
+        threading.Thread(target=self._hilo_decodificador, daemon=True, name="rfiduhf-decodificador").start()
+
+    def detener_captura(self):
+        self._activo = False
+        with self._hay_bloques:
+            self._hay_bloques.notify()
+        if self.distribuidor is not None:
+            self.distribuidor.cerrar()
+
     def run(self):
+        """Monitor de viajes; la captura corre en sus propios hilos y no se detiene por la BD."""
+
+        self.iniciar_captura()
+        pendiente = None  # (viaje, hora de deteccion del cambio)
 
         while True:
 
             try:
 
-                self.capturar()
-
                 viaje = self.get_viaje()
 
                 if self.last_viaje is None:
                     self.last_viaje = viaje
 
-                if viaje != self.last_viaje:
+                if viaje != self.last_viaje and pendiente is None:
+                    pendiente = (viaje, time.time())
 
-                    self.procesar_viaje(self.last_viaje)
+                # Se procesa cuando las lecturas del viaje que cerro ya salieron del buffer y del sumidero
+                if pendiente is not None and time.time() - pendiente[1] >= ESPERA_CIERRE_VIAJE:
 
-                    self.last_viaje = viaje
+                    with REGISTRO.histograma("rfiduhf_db_segundos", "Latencia de llamadas a la BD", op="procesar_viaje").tiempo():
+                        self.procesar_viaje(self.last_viaje)
+
+                    self.last_viaje = pendiente[0]
+                    pendiente = None
 
             except Exception as e:
+                self._m_errores.inc()
                 print("RFIDUHF error:", e)
 
             time.sleep(0.2)
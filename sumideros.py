@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Sumideros de salida para lectura/captura con reparto concurrente.
+
+Un registro es un dict con las columnas del CSV del modulo que lo produce
+(p.ej. Fecha, Hora_MS, Tag_ID, Puerto, RSSI_dBm). Distribuidor entrega cada
+registro a todos los sumideros; cada uno tiene su propia cola acotada y su
+hilo, que escribe por lotes (tamano_lote registros o intervalo_max segundos,
+lo que ocurra primero). Un sumidero lento o caido solo llena su propia cola
+y descarta lo que no cabe; nunca bloquea al lector ni a los demas sumideros.
+"""
+import csv
+import io
+import os
+import sqlite3
+import threading
+import time
+from queue import Queue, Full, Empty
+
+from metricas import REGISTRO
+
+REINTENTOS = 3
+# Campo opcional del registro con el time.monotonic() de la lectura; los sumideros lo ignoran
+# (no es una columna) y _Canal lo usa para medir la latencia lectura -> escritura
+CAMPO_T_LECTURA = "_t_lectura"
+BUCKETS_PERSISTENCIA = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Sumidero:
+    """Interfaz: implementar escribir_lote(registros); abrir/cerrar son opcionales."""
+    nombre = "sumidero"
+    tamano_lote = 500
+    intervalo_max = 0.5  # segundos
+    capacidad_cola = 20000
+
+    def abrir(self):
+        pass
+
+    def escribir_lote(self, registros):
+        raise NotImplementedError
+
+    def cerrar(self):
+        pass
+
+
+class SumideroCSV(Sumidero):
+    def __init__(self, archivo, columnas):
+        self.nombre = "csv:" + os.path.basename(archivo)
+        self.archivo = archivo
+        self.columnas = list(columnas)
+
+    def abrir(self):
+        if not os.path.exists(self.archivo):
+            with open(self.archivo, "a", newline='') as f:
+                csv.writer(f).writerow(self.columnas)
+
+    def escribir_lote(self, registros):
+        with open(self.archivo, "a", newline='') as f:
+            csv.DictWriter(f, fieldnames=self.columnas, extrasaction='ignore').writerows(registros)
+
+
+class SumideroConsola(Sumidero):
+    tamano_lote = 100
+    intervalo_max = 0.1
+
+    def __init__(self, formato):
+        self.nombre = "consola"
+        self.formato = formato
+
+    def escribir_lote(self, registros):
+        print("\n".join(self.formato(r) for r in registros))
+
+
+class SumideroSQLite(Sumidero):
+    tamano_lote = 2000
+
+    def __init__(self, archivo, tabla, columnas):
+        self.nombre = "sqlite:" + tabla
+        self.archivo = archivo
+        self.tabla = tabla
+        self.columnas = list(columnas)
+        self.conn = None
+
+    def abrir(self):
+        # La conexion se crea en el hilo del sumidero (sqlite3 no se comparte entre hilos)
+        self.conn = sqlite3.connect(self.archivo)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (
+            self.tabla, ", ".join('"%s"' % c for c in self.columnas)))
+        self._sql = "INSERT INTO %s VALUES (%s)" % (self.tabla, ", ".join("?" * len(self.columnas)))
+
+    def escribir_lote(self, registros):
+        with self.conn:
+            self.conn.executemany(self._sql, [tuple(r.get(c) for c in self.columnas) for r in registros])
+
+    def cerrar(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class SumideroPostgres(Sumidero):
+    """Carga por COPY. `transformar(registro)` devuelve la tupla en el orden de `columnas`."""
+    tamano_lote = 2000
+    intervalo_max = 1.0
+
+    def __init__(self, tabla, columnas, transformar, conexion=None):
+        self.nombre = "postgres:" + tabla
+        self.tabla = tabla
+        self.columnas = list(columnas)
+        self.transformar = transformar
+        self.conexion = conexion or {"dbname": "estomadb", "user": "postgres", "password": "sioma"}
+        self.conn = None
+
+    def abrir(self):
+        import psycopg2
+        self._psycopg2 = psycopg2
+        self._sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (self.tabla, ", ".join(self.columnas))
+
+    def escribir_lote(self, registros):
+        if self.conn is None or self.conn.closed:
+            self.conn = self._psycopg2.connect(**self.conexion)
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        for r in registros:
+            w.writerow(self.transformar(r))
+        buf.seek(0)
+        try:
+            with self.conn.cursor() as cur:
+                cur.copy_expert(self._sql, buf)
+            self.conn.commit()
+        except Exception:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+            raise
+
+    def cerrar(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def a_rfid_raw_reads(registro):
+    """Transformacion de un registro de captura/lectura a rfid_raw_reads (fecha, epc_hex, tag_id)."""
+    hora = registro.get("Hora_MS") or registro.get("Hora")
+    epc = registro["Tag_ID"]
+    return (registro["Fecha"] + " " + hora, epc, epc[-4:])
+
+
+class _Canal:
+    """Cola + hilo de escritura de un sumidero."""
+
+    def __init__(self, sumidero):
+        self.sumidero = sumidero
+        self.cola = Queue(maxsize=sumidero.capacidad_cola)
+        self.activo = True
+        etiqueta = {"sumidero": sumidero.nombre}
+        REGISTRO.gauge("sumidero_cola_profundidad", "Registros en espera", funcion=self.cola.qsize, **etiqueta)
+        self.m_escritos = REGISTRO.contador("sumidero_escritos_total", "Registros escritos", **etiqueta)
+        self.m_descartados = REGISTRO.contador("sumidero_descartados_total", "Registros descartados", **etiqueta)
+        self.m_errores = REGISTRO.contador("sumidero_errores_total", "Lotes fallidos", **etiqueta)
+        self.m_lote = REGISTRO.histograma("sumidero_lote_segundos", "Duracion de escribir_lote", **etiqueta)
+        self.m_persistencia = REGISTRO.histograma("sumidero_lectura_a_escritura_segundos",
+                                                  "Desde la lectura de la trama hasta quedar escrita",
+                                                  buckets=BUCKETS_PERSISTENCIA, **etiqueta)
+        self.hilo = threading.Thread(target=self._loop, daemon=True, name="sumidero-" + sumidero.nombre)
+        self.hilo.start()
+
+    def _loop(self):
+        s = self.sumidero
+        try:
+            s.abrir()
+        except Exception as e:
+            print("SUMIDERO %s: error al abrir: %r" % (s.nombre, e))
+        while self.activo or not self.cola.empty():
+            lote = []
+            limite = time.time() + s.intervalo_max
+            while len(lote) < s.tamano_lote:
+                espera = limite - time.time()
+                if espera <= 0:
+                    break
+                try:
+                    lote.append(self.cola.get(timeout=espera))
+                except Empty:
+                    break
+                if not self.activo:
+                    limite = 0
+            if lote:
+                self._escribir(lote)
+        try:
+            s.cerrar()
+        except Exception:
+            pass
+
+    def _escribir(self, lote):
+        for intento in range(REINTENTOS):
+            try:
+                with self.m_lote.tiempo():
+                    self.sumidero.escribir_lote(lote)
+                self.m_escritos.inc(len(lote))
+                ahora = time.monotonic()
+                for r in lote:
+                    t_lectura = r.get(CAMPO_T_LECTURA)
+                    if t_lectura is not None:
+                        self.m_persistencia.observar(ahora - t_lectura)
+                return
+            except Exception as e:
+                self.m_errores.inc()
+                print("SUMIDERO %s: error escribiendo lote (%d/%d): %r" % (
+                    self.sumidero.nombre, intento + 1, REINTENTOS, e))
+                if not self.activo:
+                    break
+                time.sleep(0.5 * (2 ** intento))
+        self.m_descartados.inc(len(lote))
+
+
+class Distribuidor:
+    def __init__(self, sumideros=()):
+        self._canales = [_Canal(s) for s in sumideros]
+
+    def agregar(self, sumidero):
+        self._canales.append(_Canal(sumidero))
+
+    def publicar(self, registro):
+        for canal in self._canales:
+            try:
+                canal.cola.put_nowait(registro)
+            except Full:
+                canal.m_descartados.inc()
+
+    def cerrar(self, timeout=5.0):
+        """Vacia las colas y espera a los hilos de escritura."""
+        for canal in self._canales:
+            canal.activo = False
+        fin = time.time() + timeout
+        for canal in self._canales:
+            canal.hilo.join(max(0.0, fin - time.time()))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Supervisor de conexion en caliente para lectores serie USB.
+
+Revisa periodicamente los puertos presentes y mantiene un hilo por puerto
+ejecutando `objetivo(puerto)`. Cuando el hilo termina (desconexion, error
+de E/S o excepcion) se relanza con backoff exponencial; al aparecer un
+puerto nuevo se lanza sin esperar al siguiente arranque de la aplicacion.
+"""
+import threading
+import time
+
+import serial.tools.list_ports
+
+from metricas import REGISTRO
+
+INTERVALO_REVISION = 0.2  # segundos entre revisiones de puertos
+BACKOFF_MIN = 0.05
+BACKOFF_MAX = 5.0
+TIEMPO_ESTABLE = 10.0  # una ejecucion mas larga que esto reinicia el backoff
+
+
+def listar_puertos(filtro="ttyUSB"):
+    return sorted(p.device for p in serial.tools.list_ports.comports() if filtro in p.device)
+
+
+def identificador_puerto(puerto):
+    """Identificador estable del adaptador USB (serie o ubicacion); la ruta si no se conoce."""
+    for p in serial.tools.list_ports.comports():
+        if p.device == puerto:
+            return p.serial_number or p.location or puerto
+    return puerto
+
+
+class EstadoPuerto:
+    __slots__ = ("puerto", "presente", "hilo", "inicio", "reinicios", "backoff", "proximo",
+                 "ultimo_error", "ultima_caida")
+
+    def __init__(self, puerto):
+        self.puerto = puerto
+        self.presente = False
+        self.hilo = None
+        self.inicio = None
+        self.reinicios = 0
+        self.backoff = BACKOFF_MIN
+        self.proximo = 0.0
+        self.ultimo_error = None
+        self.ultima_caida = None
+
+    @property
+    def activo(self):
+        return self.hilo is not None and self.hilo.is_alive()
+
+    @property
+    def uptime(self):
+        return (time.time() - self.inicio) if self.activo and self.inicio else 0.0
+
+    def resumen(self):
+        return {
+            "presente": self.presente,
+            "activo": self.activo,
+            "uptime_s": round(self.uptime, 1),
+            "reinicios": self.reinicios,
+            "ultimo_error": self.ultimo_error,
+            "ultima_caida": self.ultima_caida,
+        }
+
+
+class SupervisorPuertos:
+    def __init__(self, objetivo, filtro="ttyUSB", nombre="lector", imprimir_eventos=True):
+        self.objetivo = objetivo
+        self.filtro = filtro
+        self.nombre = nombre
+        self.imprimir_eventos = imprimir_eventos
+        self.estados = {}
+        self._activo = False
+
+    def start(self):
+        self._activo = True
+        threading.Thread(target=self._vigilar, daemon=True, name="supervisor-" + self.nombre).start()
+
+    def stop(self):
+        self._activo = False
+
+    def estado(self):
+        return {p: st.resumen() for p, st in sorted(self.estados.items())}
+
+    def puertos_activos(self):
+        return [p for p, st in self.estados.items() if st.activo]
+
+    # ----------------------------------------
+    # LOOP DE SUPERVISION
+    # ----------------------------------------
+    def _vigilar(self):
+        while self._activo:
+            try:
+                presentes = set(listar_puertos(self.filtro))
+            except Exception:
+                presentes = set()
+            ahora = time.time()
+
+            for puerto in presentes:
+                st = self.estados.get(puerto)
+                if st is None:
+                    st = self.estados[puerto] = self._registrar(puerto)
+                if not st.presente:
+                    st.presente = True
+                    # Un puerto que reaparece no espera el backoff de la caida anterior
+                    st.proximo = ahora
+                    self._evento("%s conectado" % puerto)
+                if not st.activo and ahora >= st.proximo:
+                    self._lanzar(st)
+
+            for puerto, st in self.estados.items():
+                if st.presente and puerto not in presentes:
+                    st.presente = False
+                    self._evento("%s desconectado" % puerto)
+
+            time.sleep(INTERVALO_REVISION)
+
+    def _registrar(self, puerto):
+        st = EstadoPuerto(puerto)
+        REGISTRO.gauge("lector_activo", "Hilo lector vivo (1/0)", funcion=lambda: int(st.activo),
+                       puerto=puerto, lector=self.nombre)
+        REGISTRO.gauge("lector_uptime_segundos", "Tiempo desde el ultimo (re)inicio", funcion=lambda: st.uptime,
+                       puerto=puerto, lector=self.nombre)
+        return st
+
+    def _lanzar(self, st):
+        st.inicio = time.time()
+        st.hilo = threading.Thread(target=self._ejecutar, args=(st,), daemon=True,
+                                   name="%s-%s" % (self.nombre, st.puerto))
+        st.hilo.start()
+
+    def _ejecutar(self, st):
+        try:
+            self.objetivo(st.puerto)
+        except Exception as e:
+            st.ultimo_error = repr(e)
+        if not self._activo:
+            return
+        duracion = time.time() - st.inicio
+        st.backoff = BACKOFF_MIN if duracion > TIEMPO_ESTABLE else min(st.backoff * 2, BACKOFF_MAX)
+        st.proximo = time.time() + st.backoff
+        st.ultima_caida = time.strftime("%Y-%m-%d %H:%M:%S")
+        st.reinicios += 1
+        REGISTRO.contador("lector_reinicios_total", "Reinicios de hilo lector",
+                          puerto=st.puerto, lector=self.nombre).inc()
+        self._evento("%s caido (%s), reintento en %.2f s" % (st.puerto, st.ultimo_error, st.backoff))
+
+    def _evento(self, texto):
+        if self.imprimir_eventos:
+            print("SUPERVISOR %s: %s" % (self.nombre, texto))